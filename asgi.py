@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+import asyncio
+import io
+import os
+import sys
+import cache
+import catalog
+import conditional
+import order_cache
+import services
+
+# Same routes and the same response bytes as 8inf349.py, served by an ASGI server:
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+# Cache hits of GET / and GET /order/<id> are answered on the event loop with redis.asyncio.
+# Everything else (misses, payments being processed, writes) runs the Flask views on a pool of
+# ASGI_THREADS threads, the same default as GUNICORN_THREADS
+THREADS = int(os.environ.get('ASGI_THREADS', '4'))
+
+class AsgiApp(object):
+    def __init__(self, flask_app, threads=THREADS):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        if scope["type"] != "http":
+            raise ValueError("Seules les requêtes HTTP sont servies")
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        environ = build_environ(scope, body)
+        if scope["method"] == "GET" and await self.cached_view(environ, send):
+            return
+        await self.call_wsgi(environ, send)
+
+    # Answers from the cache without leaving the event loop; False hands the request to the thread pool
+    async def cached_view(self, environ, send):
+        with self.flask_app.request_context(environ):
+            if request.endpoint == "products" and services.full_catalog_requested():
+                self.flask_app.preprocess_request()
+                state = catalog.cached(catalog.parse_version(await cache.async_redis.get(catalog.VERSION_KEY)))
+                if state is None:
+                    return False
+                response = services.catalog_response(state)
+            elif request.endpoint == "get_order":
+                self.flask_app.preprocess_request()
+                encoding = conditional.accepted_encoding()
+                id = request.view_args["id"]
+                entry = order_cache.entry(await cache.async_redis.mget(order_cache.keys(id, encoding)), encoding)
+                if entry is None or entry["state"] == order_cache.PENDING:
+                    return False
+                response = services.cached_order_response(entry, encoding)
+            else:
+                return False
+            response = self.flask_app.process_response(response)
+            chunks, status, headers = response.get_wsgi_response(environ)
+            await send(start_message(status, headers))
+            await send({"type": "http.response.body", "body": b"".join(chunks)})
+        return True
+
+    # Runs the Flask app in a pool thread; the body is sent back chunk by chunk through the event loop
+    async def call_wsgi(self, environ, send):
+        loop = asyncio.get_running_loop()
+
+        def deliver(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started.append(start_message(status, headers))
+
+            result = self.flask_app(environ, start_response)
+            sent = False
+            try:
+                for chunk in result:
+                    if not sent:
+                        deliver(started[-1])
+                        sent = True
+                    if chunk:
+                        deliver({"type": "http.response.body", "body": chunk, "more_body": True})
+                if not sent:
+                    deliver(started[-1])
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            deliver({"type": "http.response.body", "body": b""})
+
+        await loop.run_in_executor(self.executor, run)
+
+def start_message(status, headers):
+    return {"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]}
+
+def build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/{0}".format(scope.get("http_version", "1.1")),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
+
+app = AsgiApp(services.create_app())
@@ -0,0 +1,384 @@
+"""Micro-benchmarks for single code paths, on the same in-process setup as loadtest.py
+(a throwaway SQLite database, fakeredis and a local stub pay gateway).
+
+    python benchmark.py order-lines     # POST /order latency from 1 to 1,000 line items
+    python benchmark.py order-reads     # queries per GET /order/<id>, cold and warm, model_to_dict against orders.load
+    python benchmark.py payments        # card PUT throughput, queued payment against paying inline
+    python benchmark.py import          # init-db import throughput on a 100k-product fixture file
+    python benchmark.py pricing         # 10k carts priced one by one against the batched NumPy path
+    python benchmark.py asgi            # order lifecycles per second, uvicorn (asgi.py) against a threaded WSGI server
+    python benchmark.py serialize       # CPU per response: jsonify against serialization.dumps, stdlib and orjson
+
+Run `python benchmark.py <name> --help` for the options of each benchmark.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import loadtest
+
+def client_for(products, gateway_latency=0.0):
+    client = loadtest.WsgiClient(products, loadtest.start_stub_gateway(gateway_latency))
+    # Builds the catalog cache, so its query is not counted in the first measurement
+    client.request("GET", "/")
+    return client
+
+def report(rows, columns):
+    print("  ".join("{0:>14}".format(column) for column in columns))
+    for row in rows:
+        print("  ".join("{0:>14}".format(row[column]) for column in columns))
+
+def timed(function, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return durations, result
+
+def order_lines(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    # Every tenth product is out of stock in the seeded catalog
+    client = client_for(max(sizes) * 10 // 9 + 10)
+    in_stock = [i for i in range(1, max(sizes) * 10 // 9 + 10) if i % 10 != 0]
+    rows = []
+    for size in sizes:
+        body = {"products": [{"id": id, "quantity": 1} for id in in_stock[:size]]}
+        queries = []
+
+        def create():
+            status, payload, count = client.request("POST", "/order", body)
+            assert status == 302, payload
+            queries.append(count)
+
+        durations, _ = timed(create, args.repeat)
+        rows.append({"lines": size, "p50_ms": round(loadtest.percentile(durations, 0.50) * 1000, 3),
+            "p95_ms": round(loadtest.percentile(durations, 0.95) * 1000, 3), "queries": max(queries)})
+    report(rows, ["lines", "p50_ms", "p95_ms", "queries"])
+    return rows
+
+# The order read before orders.py: model_to_dict lazy-loads each relation, then one query for the lines
+def legacy_load(id):
+    from playhouse.shortcuts import model_to_dict
+    import models
+    order = model_to_dict(models.Order.get_by_id(id))
+    if order["transaction"] == None:
+        order["transaction"] = {}
+    elif order["transaction"]["error"] == None:
+        order["transaction"]["error"] = {}
+    if order["creditCard"] == None:
+        order["creditCard"] = {}
+    if order["shippingInformation"] == None:
+        order["shippingInformation"] = {}
+    order["products"] = [{"id": x["product"], "quantity": x["quantity"]}
+        for x in models.OrderProduct.select().where(models.OrderProduct.order == order["id"]).dicts()]
+    return order
+
+def order_reads(args):
+    client = client_for(100)
+    import cache
+    import models
+    import orders
+    paths = {}
+    for state, bodies in (("created", []), ("shipped", [loadtest.SHIPPING]), ("paid", [loadtest.SHIPPING, loadtest.CREDIT_CARD])):
+        status, payload, _ = client.request("POST", "/order", {"products": [{"id": 1, "quantity": 1}, {"id": 2, "quantity": 3}]})
+        paths[state] = "/" + payload["Location"]
+        for body in bodies:
+            client.request("PUT", paths[state], body)
+
+    def counted(function):
+        client.queries.count = 0
+        with models.database.connection_context():
+            result = function()
+        return result, client.queries.count
+
+    rows = []
+    for state, path in paths.items():
+        id = int(path.rsplit("/", 1)[1])
+        before, before_queries = counted(lambda: legacy_load(id))
+        after, after_queries = counted(lambda: orders.load(id))
+        assert before == after, state
+        before_durations, _ = timed(lambda: counted(lambda: legacy_load(id)), args.repeat)
+        after_durations, _ = timed(lambda: counted(lambda: orders.load(id)), args.repeat)
+        cache.redis_cache.flushall()
+        _, _, cold_queries = client.request("GET", path)
+        _, _, warm_queries = client.request("GET", path)
+        rows.append({"order": state, "before_queries": before_queries, "after_queries": after_queries,
+            "before_ms": round(loadtest.percentile(before_durations, 0.50) * 1000, 3),
+            "after_ms": round(loadtest.percentile(after_durations, 0.50) * 1000, 3),
+            "get_cold": cold_queries, "get_warm": warm_queries})
+    report(rows, ["order", "before_queries", "after_queries", "before_ms", "after_ms", "get_cold", "get_warm"])
+    return rows
+
+# "sync" runs the payment job inside the request (an rq queue with is_async=False), like the
+# blocking gateway call did; "async" only enqueues it and a SimpleWorker drains the queue afterwards
+def payments(args):
+    client = client_for(100, args.gateway_latency / 1000.0)
+    import cache
+    from rq import Queue, SimpleWorker
+    rows = []
+    for mode in ("sync", "async"):
+        queue = Queue(connection=cache.redis_cache, is_async=mode == "async")
+        cache.task_manager = queue
+        paths = []
+        for _ in range(args.orders):
+            status, payload, _ = client.request("POST", "/order", {"products": [{"id": 1, "quantity": 1}]})
+            paths.append("/" + payload["Location"])
+            client.request("PUT", paths[-1], loadtest.SHIPPING)
+
+        recorder = loadtest.Recorder()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda path: loadtest.timed(client, recorder, "PUT", "PUT", path, loadtest.CREDIT_CARD), paths))
+        elapsed = time.perf_counter() - start
+        row = {"mode": mode, "put_per_s": round(len(paths) / elapsed, 1),
+            "p95_ms": round(loadtest.percentile(recorder.latencies["PUT"], 0.95) * 1000, 3), "paid_per_s": round(len(paths) / elapsed, 1)}
+        if mode == "async":
+            start = time.perf_counter()
+            SimpleWorker([queue], connection=queue.connection).work(burst=True, logging_level="WARNING")
+            row["paid_per_s"] = round(len(paths) / (time.perf_counter() - start), 1)
+        rows.append(row)
+    report(rows, ["mode", "put_per_s", "p95_ms", "paid_per_s"])
+    return rows
+
+def fixture_products(count, changed_every=None):
+    for i in range(1, count + 1):
+        price = 5 + (i % 100) * 0.25
+        if changed_every and i % changed_every == 0:
+            price += 1
+        yield {"id": i, "name": "Produit {0}".format(i), "type": "fixture", "description": "Description du produit {0}".format(i),
+            "image": "{0}.png".format(i), "height": 10, "weight": 50 + i % 400, "price": price, "rating": 3, "in_stock": i % 10 != 0}
+
+def write_fixture(path, products):
+    with open(path, "w") as f:
+        json.dump({"products": list(products)}, f)
+
+# Same path as `flask init-db --from-file`: streamed parsing, chunked upserts, unchanged rows skipped
+def catalog_import(args):
+    client_for(0)
+    import gateway
+    import models
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    fixture = args.fixture
+    if fixture is None or not os.path.exists(fixture):
+        fixture = fixture or os.path.join(directory, "products.json")
+        write_fixture(fixture, fixture_products(args.products))
+    changed = os.path.join(directory, "changed.json")
+    write_fixture(changed, fixture_products(args.products, 100))
+
+    rows = []
+    for label, path in (("initial", fixture), ("unchanged", fixture), ("1% changed", changed)):
+        with open(path, "rb") as f:
+            stats = models.import_products(gateway.iter_products(f))
+        rows.append({"run": label, "received": stats["received"], "written": stats["written"],
+            "seconds": round(stats["seconds"], 2), "rows_per_s": int(stats["received"] / stats["seconds"])})
+    report(rows, ["run", "received", "written", "seconds", "rows_per_s"])
+    return rows
+
+def pricing_carts(args):
+    client_for(args.products)
+    import pricing
+    generator = random.Random(args.seed)
+    carts = [{"products": [{"id": generator.randint(1, args.products), "quantity": generator.randint(1, 5)}
+        for _ in range(generator.randint(1, 5))]} for _ in range(args.carts)]
+
+    def one_by_one():
+        results = []
+        for cart in carts:
+            try:
+                results.append(pricing.quote(pricing.parse(cart["products"])))
+            except pricing.PricingError as error:
+                results.append(error)
+        return results
+
+    def batched(threshold):
+        def run():
+            default, pricing.VECTOR_THRESHOLD = pricing.VECTOR_THRESHOLD, threshold
+            try:
+                return pricing.quote_many(carts)
+            finally:
+                pricing.VECTOR_THRESHOLD = default
+        return run
+
+    rows = []
+    expected = None
+    for label, function in (("one by one", one_by_one), ("quote_many", batched(len(carts) + 1)), ("quote_many numpy", batched(0))):
+        if label.endswith("numpy") and not pricing.has_numpy():
+            continue
+        durations, results = timed(function, args.repeat)
+        results = [result.errors if isinstance(result, pricing.PricingError) else result for result in results]
+        if expected is None:
+            expected = results
+        assert results == expected, label
+        best = min(durations)
+        rows.append({"path": label, "best_ms": round(best * 1000, 2), "carts_per_s": int(len(carts) / best)})
+    report(rows, ["path", "best_ms", "carts_per_s"])
+    return rows
+
+def serve_wsgi(app, threads):
+    from werkzeug.serving import BaseWSGIServer
+
+    # At most `threads` requests at a time, like a gunicorn worker with GUNICORN_THREADS
+    class PooledServer(BaseWSGIServer):
+        def process_request(self, request, client_address):
+            pool.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    pool = ThreadPoolExecutor(threads)
+    server = PooledServer("127.0.0.1", 0, app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{0}".format(server.server_port)
+
+def serve_asgi(app, threads):
+    import uvicorn
+    import asgi
+    # uvicorn binds the port itself: on a socket passed in, responses go out without TCP_NODELAY
+    server = uvicorn.Server(uvicorn.Config(asgi.AsgiApp(app, threads), host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return "http://127.0.0.1:{0}".format(server.servers[0].sockets[0].getsockname()[1])
+
+# Payments run inside the request (the WsgiClient queue is synchronous), so every card PUT
+# holds a server thread for the whole gateway latency. Both servers get --threads threads; the
+# ASGI one also answers cache hits on its event loop
+def asgi_capacity(args):
+    client = client_for(args.products, args.gateway_latency / 1000.0)
+    servers = (("wsgi", serve_wsgi(client.app, args.threads)), ("asgi", serve_asgi(client.app, args.threads)))
+    rows = []
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        for label, url in servers:
+            recorder = loadtest.Recorder()
+            http = loadtest.HttpClient(url)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(lambda _: loadtest.lifecycle(http, recorder, args.products), range(args.lifecycles)))
+            elapsed = time.perf_counter() - start
+            latencies = [value for values in recorder.latencies.values() for value in values]
+            rows.append({"server": label, "concurrency": concurrency, "lifecycles_per_s": round(args.lifecycles / elapsed, 1),
+                "p95_ms": round(loadtest.percentile(latencies, 0.95) * 1000, 1),
+                "catalog_p95_ms": round(loadtest.percentile(recorder.latencies["GET /"], 0.95) * 1000, 1), "errors": recorder.errors})
+    report(rows, ["server", "concurrency", "lifecycles_per_s", "p95_ms", "catalog_p95_ms", "errors"])
+    return rows
+
+# CPU time (process_time) per response body: the catalog, and an order read back from its cached JSON
+def serialize(args):
+    client = client_for(args.products)
+    import catalog
+    import orders
+    import order_cache
+    import serialization
+    from flask import jsonify
+    status, payload, _ = client.request("POST", "/order", {"products": [{"id": i, "quantity": 1} for i in range(1, 10)]})
+    id = int(payload["Location"].split("/")[1])
+    client.request("PUT", "/order/{0}".format(id), loadtest.SHIPPING)
+    with client.app.app_context():
+        products = catalog.page(catalog.fields_for(None))[0]
+        order = orders.load(id)
+    cached = order_cache.serialize(order)
+
+    serialization.has_orjson()
+
+    def backend(name, function):
+        def run():
+            default = serialization.orjson
+            if name == "stdlib":
+                serialization.orjson = None
+            try:
+                with client.app.test_request_context():
+                    return function()
+            finally:
+                serialization.orjson = default
+        return run
+
+    cases = [
+        ("catalog", "jsonify", 1, backend("stdlib", lambda: jsonify({"products": products}).get_data())),
+        ("catalog", "dumps stdlib", 1, backend("stdlib", lambda: serialization.dumps({"products": products}))),
+        # Before: the cached JSON was parsed and serialized again through jsonify
+        ("order read", "loads + jsonify", args.reads, backend("stdlib", lambda: [jsonify(serialization.loads(cached)).get_data() for _ in range(args.reads)])),
+        ("order read", "cached bytes", args.reads, backend("stdlib", lambda: [serialization.raw_response(cached).get_data() for _ in range(args.reads)])),
+    ]
+    if serialization.has_orjson():
+        cases.insert(2, ("catalog", "dumps orjson", 1, backend("orjson", lambda: serialization.dumps({"products": products}))))
+    rows = []
+    for payload, path, count, function in cases:
+        durations = []
+        for _ in range(args.repeat):
+            start = time.process_time()
+            function()
+            durations.append(time.process_time() - start)
+        rows.append({"payload": payload, "path": path, "cpu_us": round(min(durations) / count * 1e6, 1)})
+    report(rows, ["payload", "path", "cpu_us"])
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="also write the results as JSON")
+    benchmarks = parser.add_subparsers(dest="benchmark")
+    benchmarks.required = True
+
+    command = benchmarks.add_parser("order-lines", help="POST /order latency by number of line items")
+    command.add_argument("--sizes", default="1,10,100,1000")
+    command.add_argument("--repeat", type=int, default=20)
+    command.set_defaults(run=order_lines)
+
+    command = benchmarks.add_parser("order-reads", help="queries per order read, before and after orders.py")
+    command.add_argument("--repeat", type=int, default=200)
+    command.set_defaults(run=order_reads)
+
+    command = benchmarks.add_parser("payments", help="card PUT throughput with and without the payment queue")
+    command.add_argument("--orders", type=int, default=200)
+    command.add_argument("--concurrency", type=int, default=8)
+    command.add_argument("--gateway-latency", type=float, default=50, help="stub gateway latency in ms")
+    command.set_defaults(run=payments)
+
+    command = benchmarks.add_parser("import", help="catalog import throughput from a fixture file")
+    command.add_argument("--products", type=int, default=100000)
+    command.add_argument("--fixture", help="products file to read, written first when it does not exist")
+    command.set_defaults(run=catalog_import)
+
+    command = benchmarks.add_parser("pricing", help="per-cart pricing against batched quoting")
+    command.add_argument("--carts", type=int, default=10000)
+    command.add_argument("--products", type=int, default=1000, help="catalog size")
+    command.add_argument("--repeat", type=int, default=5)
+    command.add_argument("--seed", type=int, default=1)
+    command.set_defaults(run=pricing_carts)
+
+    command = benchmarks.add_parser("asgi", help="concurrent capacity of the ASGI and WSGI servers with a slow gateway")
+    command.add_argument("--lifecycles", type=int, default=200, help="order lifecycles per run")
+    command.add_argument("--concurrency", default="4,16,64", help="concurrent clients, comma separated")
+    command.add_argument("--threads", type=int, default=4, help="threads of each server")
+    command.add_argument("--products", type=int, default=1000)
+    command.add_argument("--gateway-latency", type=float, default=200, help="stub gateway latency in ms")
+    command.set_defaults(run=asgi_capacity)
+
+    command = benchmarks.add_parser("serialize", help="CPU per JSON response with each serialization path")
+    command.add_argument("--products", type=int, default=50000, help="catalog size")
+    command.add_argument("--reads", type=int, default=20000, help="order reads per run")
+    command.add_argument("--repeat", type=int, default=5)
+    command.set_defaults(run=serialize)
+
+    args = parser.parse_args(argv)
+    result = args.run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
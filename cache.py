@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+import instrumentation
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+
+_lock = threading.RLock()
+
+# redis and rq are only imported, and the clients only created, when cache.redis_cache,
+# cache.async_redis or cache.task_manager is first used. Tests and the load test can assign
+# any of them beforehand
+def __getattr__(name):
+    if name == "redis_cache":
+        return get_redis()
+    if name == "async_redis":
+        return get_async_redis()
+    if name == "task_manager":
+        return get_queue()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+def get_redis():
+    with _lock:
+        if "redis_cache" not in globals():
+            globals()["redis_cache"] = _timed_client(REDIS_HOST)
+        return globals()["redis_cache"]
+
+# redis.asyncio client for the event-loop views of asgi.py
+def get_async_redis():
+    with _lock:
+        if "async_redis" not in globals():
+            globals()["async_redis"] = _timed_async_client(REDIS_HOST)
+        return globals()["async_redis"]
+
+def get_queue():
+    with _lock:
+        if "task_manager" not in globals():
+            from rq import Queue
+            globals()["task_manager"] = Queue(connection=get_redis())
+        return globals()["task_manager"]
+
+def _timed_client(host):
+    import redis
+    from redis.client import Pipeline
+
+    class TimedPipeline(Pipeline):
+        def execute(self, raise_on_error=True):
+            start = time.perf_counter()
+            try:
+                return super(TimedPipeline, self).execute(raise_on_error)
+            finally:
+                instrumentation.record("redis", "pipeline", time.perf_counter() - start)
+
+    class TimedRedis(redis.Redis):
+        def execute_command(self, *args, **options):
+            start = time.perf_counter()
+            try:
+                return super(TimedRedis, self).execute_command(*args, **options)
+            finally:
+                instrumentation.record("redis", str(args[0]).lower(), time.perf_counter() - start)
+
+        def pipeline(self, transaction=True, shard_hint=None):
+            return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+    return TimedRedis(host)
+
+def _timed_async_client(host):
+    import redis.asyncio
+
+    class TimedAsyncRedis(redis.asyncio.Redis):
+        async def execute_command(self, *args, **options):
+            start = time.perf_counter()
+            try:
+                return await super(TimedAsyncRedis, self).execute_command(*args, **options)
+            finally:
+                instrumentation.record("redis", str(args[0]).lower(), time.perf_counter() - start)
+
+    return TimedAsyncRedis(host)
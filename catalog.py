@@ -0,0 +1,121 @@
+from flask.cli import with_appcontext
+import threading
+import click
+import cache
+import conditional
+import models
+import pricing
+import serialization
+
+VERSION_KEY = "catalog:version"
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK = 500
+LISTED_FIELDS = ["id", "name", "typeOf", "description", "image", "height", "weight", "price", "rating", "inStock"]
+
+# Per-process copy of the catalog, rebuilt whenever the version stored in Redis changes
+_lock = threading.Lock()
+_state = {"version": None, "body": None, "index": {}}
+stats = {"hits": 0, "misses": 0}
+
+def current_version():
+    return parse_version(cache.redis_cache.get(VERSION_KEY))
+
+def parse_version(version):
+    if version is None:
+        return 0
+    return int(version)
+
+def bump_version():
+    return cache.redis_cache.incr(VERSION_KEY)
+
+def _build(version):
+    products = list(models.Product.select(*fields_for(None)).order_by(models.Product.id).dicts())
+    body = serialization.dumps({"products" : products})
+    index = {}
+    for i in products:
+        index[i["id"]] = (pricing.to_cents(i["price"]), i["weight"], i["inStock"])
+    return {"version": version, "body": body, "etag": conditional.etag_for(body), "variants": conditional.compress(body), "index": index}
+
+# The copy held by this process when it is still at version, otherwise None
+def cached(version):
+    state = _state
+    if state["version"] == version:
+        stats["hits"] += 1
+        return state
+    return None
+
+def get():
+    global _state
+    version = current_version()
+    state = cached(version)
+    if state is not None:
+        return state
+    with _lock:
+        if _state["version"] != version:
+            stats["misses"] += 1
+            _state = _build(version)
+        else:
+            stats["hits"] += 1
+        return _state
+
+def fields_for(names):
+    if not names:
+        return [models.Product._meta.fields[name] for name in LISTED_FIELDS]
+    result = []
+    for name in names.split(","):
+        name = name.strip()
+        if name not in LISTED_FIELDS:
+            return None
+        result.append(models.Product._meta.fields[name])
+    return result
+
+def _rows(fields, cursor, limit):
+    query = models.Product.select(*fields).order_by(models.Product.id)
+    if cursor is not None:
+        query = query.where(models.Product.id > cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    return list(query.dicts())
+
+# Keyset pagination needs the id even when the client did not ask for it
+def _with_id(fields):
+    if any(field.name == "id" for field in fields):
+        return fields, False
+    return [models.Product.id] + fields, True
+
+def page(fields, cursor=None, limit=None):
+    fields, strip_id = _with_id(fields)
+    # One extra row tells whether another page follows
+    rows = _rows(fields, cursor, limit + 1 if limit is not None else None)
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["id"]
+    if strip_id:
+        for row in rows:
+            del row["id"]
+    return rows, next_cursor
+
+# Keyset pages of STREAM_CHUNK rows, so only one chunk is ever held in memory
+def stream(fields, cursor=None, limit=None):
+    fields, strip_id = _with_id(fields)
+    sent = 0
+    while limit is None or sent < limit:
+        size = STREAM_CHUNK if limit is None else min(STREAM_CHUNK, limit - sent)
+        rows = _rows(fields, cursor, size)
+        if not rows:
+            break
+        cursor = rows[-1]["id"]
+        sent += len(rows)
+        for row in rows:
+            if strip_id:
+                del row["id"]
+            yield serialization.dumps(row) + b"\n"
+        if len(rows) < size:
+            break
+
+@click.command("refresh-catalog")
+@with_appcontext
+def refresh_catalog_command():
+    version = bump_version()
+    click.echo("Catalog version bumped to {0}.".format(version))
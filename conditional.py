@@ -0,0 +1,54 @@
+from flask import current_app, request
+import gzip
+import hashlib
+
+# brotli is imported by the first response that needs the list of encodings
+brotli = None
+_brotli_checked = False
+
+def has_brotli():
+    global brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        _brotli_checked = True
+    return brotli is not None
+
+def encodings():
+    return ["br", "gzip"] if has_brotli() else ["gzip"]
+
+def etag_for(body):
+    return hashlib.sha1(body).hexdigest()
+
+def compress(body):
+    variants = {"gzip": gzip.compress(body, 6)}
+    if has_brotli():
+        variants["br"] = brotli.compress(body)
+    return variants
+
+def accepted_encoding():
+    encoding = request.accept_encodings.best_match(encodings())
+    if encoding is None or request.accept_encodings[encoding] == 0:
+        return None
+    return encoding
+
+# A strong ETag must differ for each content coding of the same body
+def variant_etag(etag, encoding):
+    return etag if encoding is None else "{0}-{1}".format(etag, encoding)
+
+# Answers 304 when the client already holds etag in any coding, otherwise the best pre-compressed variant
+def respond(body, etag, variants=None, encoding=None, mimetype="application/json"):
+    if encoding is None or not variants or variants.get(encoding) is None:
+        encoding = None
+    if any(request.if_none_match.contains(variant_etag(etag, held)) for held in [None] + encodings()):
+        res = current_app.response_class(status=304)
+    elif encoding is not None:
+        res = current_app.response_class(variants[encoding], mimetype=mimetype)
+        res.headers["Content-Encoding"] = encoding
+    else:
+        res = current_app.response_class(body, mimetype=mimetype)
+    res.set_etag(variant_etag(etag, encoding))
+    res.vary.add("Accept-Encoding")
+    return res
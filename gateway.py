@@ -0,0 +1,132 @@
+import os
+import json
+import random
+import threading
+import time
+import instrumentation
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+PAY_URL = os.environ.get('PAY_URL', 'http://jgnault.ddns.net/shops/pay/')
+PRODUCTS_URL = os.environ.get('PRODUCTS_URL', 'http://jgnault.ddns.net/shops/products/')
+CONNECT_TIMEOUT = float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.environ.get('GATEWAY_READ_TIMEOUT', '10'))
+POOL_SIZE = int(os.environ.get('GATEWAY_POOL_SIZE', '10'))
+MAX_RETRIES = int(os.environ.get('GATEWAY_MAX_RETRIES', '3'))
+RETRY_BACKOFF = float(os.environ.get('GATEWAY_RETRY_BACKOFF', '0.2'))
+BREAKER_THRESHOLD = int(os.environ.get('GATEWAY_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('GATEWAY_BREAKER_COOLDOWN', '30'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class CircuitOpenError(Exception):
+    pass
+
+_lock = threading.Lock()
+_session_lock = threading.Lock()
+_session = None
+
+# One keep-alive session shared by every call to the remote shop, created by the first call
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+_breaker = {"failures": 0, "opened_at": None}
+histograms = {}
+
+def _observe(name, elapsed):
+    instrumentation.record("http", name, elapsed)
+    with _lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0}
+            histograms[name] = histogram
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                histogram["buckets"][i] += 1
+        histogram["count"] += 1
+        histogram["sum"] += elapsed
+
+def _before_call():
+    with _lock:
+        opened_at = _breaker["opened_at"]
+        if opened_at is None:
+            return
+        if time.monotonic() - opened_at < BREAKER_COOLDOWN:
+            raise CircuitOpenError("Le service distant est indisponible")
+        # Half-open: let this call through, the next failure re-opens the circuit
+        _breaker["opened_at"] = None
+        _breaker["failures"] = BREAKER_THRESHOLD - 1
+
+def _after_call(success):
+    with _lock:
+        if success:
+            _breaker["failures"] = 0
+            return
+        _breaker["failures"] += 1
+        if _breaker["failures"] >= BREAKER_THRESHOLD:
+            _breaker["opened_at"] = time.monotonic()
+
+def call(name, method, url, retries=0, **kwargs):
+    import requests
+    session = get_session()
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    attempt = 0
+    while True:
+        _before_call()
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            _observe(name, time.perf_counter() - start)
+            _after_call(False)
+            if attempt >= retries:
+                raise
+        else:
+            _observe(name, time.perf_counter() - start)
+            _after_call(response.status_code < 500)
+            if response.status_code < 500 or attempt >= retries:
+                return response
+        attempt += 1
+        time.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+
+# Not retried: a payment must never be sent twice
+def pay(payload):
+    return call("pay", "POST", PAY_URL, data=json.dumps(payload)).json()
+
+# Yields the products of a {"products": [...]} document, incrementally when ijson is installed
+def iter_products(stream):
+    if ijson is not None:
+        for product in ijson.items(stream, "products.item", use_float=True):
+            yield product
+    else:
+        for product in json.load(stream)["products"]:
+            yield product
+
+def stream_products():
+    response = call("products", "GET", PRODUCTS_URL, retries=MAX_RETRIES, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    try:
+        for product in iter_products(response.raw):
+            yield product
+    finally:
+        response.close()
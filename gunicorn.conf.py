@@ -0,0 +1,57 @@
+import gc
+import multiprocessing
+import os
+import time
+
+# gunicorn -c gunicorn.conf.py 8inf349:app
+bind = "0.0.0.0:{0}".format(os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+# The app is imported once in the master and the workers inherit it through fork
+preload_app = True
+
+_started = time.perf_counter()
+
+def rss():
+    # Resident and shared (copy-on-write pages still common with the master) memory in MB, Linux only
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0])
+    except OSError:
+        return None, None
+    return fields["Rss"] / 1024.0, (fields["Shared_Clean"] + fields["Shared_Dirty"]) / 1024.0
+
+def when_ready(server):
+    import cache
+    import catalog
+    import gateway
+    import models
+
+    # Warmed here, the catalog body and index are shared copy-on-write by every worker
+    products = 0
+    try:
+        with models.database.connection_context():
+            products = len(catalog.get()["index"])
+    except Exception as e:
+        server.log.warning("Catalog not warmed before fork: %s", e)
+
+    # Sockets must not be shared between processes: each worker opens its own after the fork.
+    # The master serves no request, so the pools stay empty for workers respawned later
+    models.database.close_all()
+    cache.redis_cache.connection_pool.disconnect()
+    gateway.close_session()
+
+    # Keeps the collector from writing to the inherited objects, which would copy their pages
+    gc.freeze()
+    resident, shared = rss()
+    server.log.info("Ready in %.2fs with %d products cached, master RSS %s MB", time.perf_counter() - _started, products, resident and round(resident, 1))
+
+def post_worker_init(worker):
+    resident, shared = rss()
+    if resident is not None:
+        worker.log.info("Worker %s booted, RSS %.1f MB (%.1f MB shared)", worker.pid, resident, shared)
@@ -0,0 +1,76 @@
+from flask import current_app, request
+import hashlib
+import os
+import threading
+import time
+import cache
+import serialization
+
+LOCK_TIMEOUT = float(os.environ.get('ORDER_LOCK_TIMEOUT', '60'))
+LOCK_WAIT = float(os.environ.get('ORDER_LOCK_WAIT', '5'))
+KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', '86400'))
+TRANSIENT_STATUSES = (409, 423, 429)
+KEY_REUSED = {"errors" : {"order": {"code" : "idempotency-key-reused", "name" : "Cette clé d'idempotence a déjà servi pour une autre requête"}}}
+
+class LockTimeout(Exception):
+    pass
+
+_stats_lock = threading.Lock()
+stats = {"acquired": 0, "contended": 0, "timeouts": 0, "wait_seconds": 0.0, "replays": 0}
+
+def _count(name, value=1):
+    with _stats_lock:
+        stats[name] += value
+
+def lock_key(id):
+    return "lock:order:{0}".format(id)
+
+def response_key(id, idempotency_key):
+    return "idempotency:order:{0}:{1}".format(id, idempotency_key)
+
+class order_lock(object):
+    def __init__(self, id, wait=LOCK_WAIT):
+        self.lock = cache.redis_cache.lock(lock_key(id), timeout=LOCK_TIMEOUT)
+        self.wait = wait
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            _count("contended")
+            start = time.perf_counter()
+            acquired = self.lock.acquire(blocking=True, blocking_timeout=self.wait)
+            _count("wait_seconds", time.perf_counter() - start)
+            if not acquired:
+                _count("timeouts")
+                raise LockTimeout("La commande est déjà en cours de modification")
+        _count("acquired")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lock.release()
+        return False
+
+# Identifies the request a key first answered: same method and same JSON, whatever its spacing
+def fingerprint():
+    payload = request.get_json(silent=True)
+    body = serialization.dumps(payload) if payload is not None else request.get_data()
+    return hashlib.sha1(request.method.encode("utf-8") + b"\n" + body).hexdigest()
+
+def replay(id, idempotency_key):
+    stored = cache.redis_cache.get(response_key(id, idempotency_key))
+    if stored is None:
+        return None
+    stored = serialization.loads(stored)
+    # A key reused for another request (a card PUT after a shipping PUT) must not get the old answer
+    if stored.get("request", fingerprint()) != fingerprint():
+        return serialization.json_response(KEY_REUSED, 422)
+    _count("replays")
+    res = current_app.response_class(stored["body"], status=stored["status"], mimetype=stored["mimetype"])
+    res.headers["Idempotent-Replayed"] = "true"
+    return res
+
+# Server errors and conflicts depend on the moment of the call (409: payment in progress), a retry must run again
+def remember(id, idempotency_key, res):
+    if res.status_code >= 500 or res.status_code in TRANSIENT_STATUSES:
+        return
+    stored = {"status": res.status_code, "mimetype": res.mimetype, "body": res.get_data(as_text=True), "request": fingerprint()}
+    cache.redis_cache.set(response_key(id, idempotency_key), serialization.dumps(stored), ex=KEY_TTL)
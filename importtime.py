@@ -0,0 +1,74 @@
+"""Measures how long importing the app takes and fails when it goes over budget.
+
+Each run imports the module in a fresh interpreter with `python -X importtime`.
+The fastest run is compared with --budget, which gives a stable number on a busy
+machine. The check also fails when one of the --forbid modules is imported at
+startup: Redis, rq, requests, NumPy, orjson and brotli are only loaded by the
+first request, job or batch that needs them.
+
+    python importtime.py
+    python importtime.py --module models --budget 150 --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+def measure(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    imported = set()
+    total = None
+    children = []
+    # Children are printed before their parent, so direct imports are the depth 1 lines seen since the last depth 0 one
+    pending = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        imported.add(name)
+        if depth == 1:
+            pending.append((cumulative, name))
+        elif depth == 0:
+            if name == module:
+                total = cumulative
+                children = sorted(pending, reverse=True)
+            pending = []
+    return total, imported, children
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="services", help="module to import")
+    parser.add_argument("--budget", type=float, default=400, help="maximum import time in ms")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--forbid", default="redis,rq,requests,numpy,orjson,brotli", help="comma-separated modules that must not be imported")
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    total, imported, children = min(runs, key=lambda run: run[0])
+    print("import {0}: {1:.1f} ms (best of {2}, budget {3:.0f} ms)".format(args.module, total / 1000.0, args.runs, args.budget))
+    for cumulative, name in children[:args.top]:
+        print("  {0:>8.1f} ms  {1}".format(cumulative / 1000.0, name))
+
+    failed = False
+    if total / 1000.0 > args.budget:
+        print("Regression: import {0} takes {1:.1f} ms, over the {2:.0f} ms budget".format(args.module, total / 1000.0, args.budget), file=sys.stderr)
+        failed = True
+    for name in args.forbid.split(","):
+        if name and name in imported:
+            print("Regression: {0} is imported at startup".format(name), file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+from flask import g, request, current_app, has_request_context
+import cProfile
+import os
+import threading
+import time
+
+PROFILING = os.environ.get('PROFILING', 'False') == 'True'
+PROFILE_HEADER = "X-Profile"
+
+# Process-wide totals, one entry per (kind, name)
+_lock = threading.Lock()
+call_totals = {}
+request_totals = {}
+
+def record(kind, name, elapsed):
+    with _lock:
+        entry = call_totals.get((kind, name))
+        if entry is None:
+            entry = call_totals[(kind, name)] = {"count": 0, "seconds": 0.0}
+        entry["count"] += 1
+        entry["seconds"] += elapsed
+    if has_request_context() and "spans" in g:
+        g.spans.append((kind, name, elapsed))
+
+def _start_request():
+    g.spans = []
+    g.request_start = time.perf_counter()
+    if current_app.config.get("PROFILING", PROFILING) and request.headers.get(PROFILE_HEADER):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _finish_request(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "unknown"
+    with _lock:
+        key = (endpoint, response.status_code)
+        entry = request_totals.get(key)
+        if entry is None:
+            entry = request_totals[key] = {"count": 0, "seconds": 0.0}
+        entry["count"] += 1
+        entry["seconds"] += elapsed
+
+    totals = {}
+    for kind, name, duration in g.spans:
+        count, seconds = totals.get(kind, (0, 0.0))
+        totals[kind] = (count + 1, seconds + duration)
+    timings = ["{0};dur={1:.3f};desc=\"{2} calls\"".format(kind, seconds * 1000, count) for kind, (count, seconds) in sorted(totals.items())]
+    timings.append("app;dur={0:.3f}".format(elapsed * 1000))
+    response.headers["Server-Timing"] = ", ".join(timings)
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        directory = os.path.join(current_app.instance_path, "profiles")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "{0}-{1}.prof".format(endpoint, time.time_ns()))
+        profiler.dump_stats(path)
+        response.headers["X-Profile-File"] = path
+    return response
+
+def initialize(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
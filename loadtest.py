@@ -0,0 +1,254 @@
+"""Replays traffic against the order API and reports latency percentiles.
+
+In-process (default), the app runs through the WSGI test client on a throwaway
+SQLite database, fakeredis when it is installed and a local stub pay gateway:
+
+    python loadtest.py --iterations 200 --gateway-latency 50 --output baseline.json
+    python loadtest.py --baseline baseline.json
+
+Against a running server (gunicorn, docker-compose...), pass --url. The stub
+gateway is still started; point the server's PAY_URL at the address it prints.
+
+    python loadtest.py --url http://localhost:5000 --concurrency 16
+
+--replay takes a JSON lines file of {"method", "path", "json"} records. The
+string "{order}" in a path is replaced by the id of the last order created.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SHIPPING = {"order": {"email": "client@uqac.ca", "shipping_information": {
+    "country": "Canada", "address": "555 boulevard de l'Université", "postal_code": "G7H 2B1",
+    "city": "Chicoutimi", "province": "QC"}}}
+CREDIT_CARD = {"credit_card": {"name": "John Doe", "number": "4242 4242 4242 4242",
+    "expiration_year": 2030, "cvv": "123", "expiration_month": 9}}
+
+# Every charge received is appended to charges when a list is given
+def start_stub_gateway(latency, charges=None):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if charges is not None:
+                charges.append(body)
+            time.sleep(latency)
+            payload = json.dumps({"credit_card": body.get("credit_card"), "transaction": {
+                "id": "stub-{0}".format(time.monotonic_ns()), "success": True,
+                "amount_charged": body.get("amount_charged")}}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{0}/shops/pay/".format(server.server_address[1])
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.queries = {}
+        self.errors = 0
+
+    def add(self, label, elapsed, status, queries=None):
+        with self.lock:
+            self.latencies.setdefault(label, []).append(elapsed)
+            if queries is not None:
+                self.queries.setdefault(label, []).append(queries)
+            if status >= 500:
+                self.errors += 1
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+# Runs services.create_app() in-process on SQLite and fakeredis
+class WsgiClient(object):
+    def __init__(self, products, gateway_url):
+        directory = tempfile.mkdtemp(prefix="loadtest-")
+        os.environ.setdefault("DB_ENGINE", "sqlite")
+        os.environ.setdefault("DB_NAME", os.path.join(directory, "loadtest"))
+        os.environ["PAY_URL"] = gateway_url
+        import cache
+        try:
+            import fakeredis
+            from rq import Queue
+            server = fakeredis.FakeServer()
+            cache.redis_cache = fakeredis.FakeRedis(server=server)
+            cache.async_redis = fakeredis.FakeAsyncRedis(server=server)
+            cache.task_manager = Queue(connection=cache.redis_cache, is_async=False)
+        except ImportError:
+            pass
+        import models
+        import services
+        models.create_tables()
+        models.import_products({"id": i, "name": "Produit {0}".format(i), "type": "loadtest",
+            "description": "", "image": "", "height": 10, "weight": 50 + i % 400,
+            "price": 5 + (i % 100) * 0.25, "rating": 3, "in_stock": i % 10 != 0} for i in range(1, products + 1))
+        self.local = threading.local()
+        self.app = services.create_app()
+        self.queries = threading.local()
+        original = models.database.execute_sql
+        client = self
+
+        def counting(sql, params=None, *args, **kwargs):
+            client.queries.count = getattr(client.queries, "count", 0) + 1
+            return original(sql, params, *args, **kwargs)
+
+        models.database.execute_sql = counting
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        self.queries.count = 0
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code, response.get_json(silent=True), self.queries.count
+
+# Drives an already running server over keep-alive HTTP connections
+class HttpClient(object):
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip("/")
+        self.local = threading.local()
+        self.requests = requests
+
+    def request(self, method, path, body=None):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.url + path, json=body, allow_redirects=False)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return response.status_code, payload, None
+
+def timed(client, recorder, label, method, path, body=None):
+    start = time.perf_counter()
+    status, payload, queries = client.request(method, path, body)
+    recorder.add(label, time.perf_counter() - start, status, queries)
+    return status, payload
+
+def lifecycle(client, recorder, products):
+    timed(client, recorder, "GET /", "GET", "/")
+    lines = [{"id": 1 + (time.monotonic_ns() // 7 + i * 13) % products, "quantity": 1 + i} for i in range(3)]
+    lines = [line for line in lines if line["id"] % 10 != 0] or [{"id": 1, "quantity": 1}]
+    status, payload = timed(client, recorder, "POST /order", "POST", "/order", {"products": lines})
+    if status != 302 or payload is None:
+        return
+    path = "/" + payload["Location"]
+    timed(client, recorder, "PUT /order/<id> shipping", "PUT", path, SHIPPING)
+    timed(client, recorder, "PUT /order/<id> credit_card", "PUT", path, CREDIT_CARD)
+    for attempt in range(200):
+        status, payload = timed(client, recorder, "GET /order/<id>", "GET", path)
+        if status != 202:
+            break
+        time.sleep(0.01)
+    timed(client, recorder, "GET /orders?ids=", "GET", "/orders?ids=" + path.rsplit("/", 1)[1])
+
+def replay(client, recorder, records):
+    order = None
+    for record in records:
+        path = record["path"]
+        if "{order}" in path:
+            if order is None:
+                continue
+            path = path.replace("{order}", str(order))
+        status, payload = timed(client, recorder, "{0} {1}".format(record["method"], record["path"]),
+            record["method"], path, record.get("json"))
+        if status == 302 and payload and "Location" in payload:
+            order = payload["Location"].split("/")[-1]
+
+def summarize(recorder, elapsed):
+    routes = {}
+    total = 0
+    for label, values in sorted(recorder.latencies.items()):
+        total += len(values)
+        routes[label] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        }
+        if label in recorder.queries:
+            routes[label]["queries_per_request"] = round(sum(recorder.queries[label]) / len(recorder.queries[label]), 2)
+    return {
+        "requests": total,
+        "errors": recorder.errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed > 0 else 0,
+        "routes": routes,
+    }
+
+def regressions(result, baseline, tolerance):
+    found = []
+    for label, route in baseline.get("routes", {}).items():
+        current = result["routes"].get(label)
+        if current is None:
+            continue
+        for metric in ("p95_ms", "queries_per_request"):
+            if metric in route and metric in current and current[metric] > route[metric] * (1 + tolerance) + 0.5:
+                found.append("{0} {1}: {2} > {3}".format(label, metric, current[metric], route[metric]))
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server; in-process WSGI when omitted")
+    parser.add_argument("--iterations", type=int, default=100, help="synthetic order lifecycles to run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--products", type=int, default=1000, help="catalog size seeded in-process")
+    parser.add_argument("--gateway-latency", type=float, default=20, help="stub gateway latency in ms")
+    parser.add_argument("--replay", help="JSON lines file of recorded requests")
+    parser.add_argument("--output", help="write the results as a JSON baseline")
+    parser.add_argument("--baseline", help="fail when p95 or queries per request regress past this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    gateway_url = start_stub_gateway(args.gateway_latency / 1000.0)
+    if args.url:
+        print("Stub pay gateway listening on {0}".format(gateway_url), file=sys.stderr)
+        client = HttpClient(args.url)
+    else:
+        client = WsgiClient(args.products, gateway_url)
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    if args.replay:
+        with open(args.replay) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda _: replay(client, recorder, records), range(args.concurrency)))
+    else:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda _: lifecycle(client, recorder, args.products), range(args.iterations)))
+    result = summarize(recorder, time.perf_counter() - start)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for line in found:
+            print("Regression: " + line, file=sys.stderr)
+        if found:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import catalog
+import gateway
+import idempotency
+import instrumentation
+import models
+import order_cache
+
+def _line(lines, name, value, labels=None):
+    if labels:
+        label_text = ",".join("{0}=\"{1}\"".format(key, labels[key]) for key in sorted(labels))
+        lines.append("{0}{{{1}}} {2}".format(name, label_text, value))
+    else:
+        lines.append("{0} {1}".format(name, value))
+
+# Prometheus text exposition of this worker's counters
+def render():
+    lines = []
+    with instrumentation._lock:
+        request_items = sorted(instrumentation.request_totals.items())
+        call_items = sorted(instrumentation.call_totals.items())
+    lines.append("# TYPE http_requests_total counter")
+    for (endpoint, status), entry in request_items:
+        _line(lines, "http_requests_total", entry["count"], {"endpoint": endpoint, "status": status})
+    lines.append("# TYPE http_request_seconds_total counter")
+    for (endpoint, status), entry in request_items:
+        _line(lines, "http_request_seconds_total", entry["seconds"], {"endpoint": endpoint, "status": status})
+    lines.append("# TYPE dependency_calls_total counter")
+    for (kind, name), entry in call_items:
+        _line(lines, "dependency_calls_total", entry["count"], {"kind": kind, "name": name})
+    lines.append("# TYPE dependency_seconds_total counter")
+    for (kind, name), entry in call_items:
+        _line(lines, "dependency_seconds_total", entry["seconds"], {"kind": kind, "name": name})
+
+    lines.append("# TYPE cache_hits_total counter")
+    _line(lines, "cache_hits_total", catalog.stats["hits"], {"cache": "catalog"})
+    _line(lines, "cache_hits_total", order_cache.stats["hits"], {"cache": "order"})
+    lines.append("# TYPE cache_misses_total counter")
+    _line(lines, "cache_misses_total", catalog.stats["misses"], {"cache": "catalog"})
+    _line(lines, "cache_misses_total", order_cache.stats["misses"], {"cache": "order"})
+
+    pool = models.pool_size()
+    lines.append("# TYPE db_pool_connections gauge")
+    _line(lines, "db_pool_connections", pool["in_use"], {"state": "in_use"})
+    _line(lines, "db_pool_connections", pool["idle"], {"state": "idle"})
+    _line(lines, "db_pool_max_connections", pool["max"])
+    lines.append("# TYPE db_pool_checkouts_total counter")
+    _line(lines, "db_pool_checkouts_total", models.pool_stats["checkouts"])
+    lines.append("# TYPE db_pool_wait_seconds_total counter")
+    _line(lines, "db_pool_wait_seconds_total", models.pool_stats["wait_seconds"])
+
+    lines.append("# TYPE order_lock_total counter")
+    for outcome in ("acquired", "contended", "timeouts"):
+        _line(lines, "order_lock_total", idempotency.stats[outcome], {"outcome": outcome})
+    lines.append("# TYPE order_lock_wait_seconds_total counter")
+    _line(lines, "order_lock_wait_seconds_total", idempotency.stats["wait_seconds"])
+    lines.append("# TYPE idempotent_replays_total counter")
+    _line(lines, "idempotent_replays_total", idempotency.stats["replays"])
+
+    lines.append("# TYPE gateway_latency_seconds histogram")
+    for name, histogram in sorted(gateway.histograms.items()):
+        for bound, count in zip(gateway.LATENCY_BUCKETS, histogram["buckets"]):
+            _line(lines, "gateway_latency_seconds_bucket", count, {"call": name, "le": bound})
+        _line(lines, "gateway_latency_seconds_bucket", histogram["count"], {"call": name, "le": "+Inf"})
+        _line(lines, "gateway_latency_seconds_sum", histogram["sum"], {"call": name})
+        _line(lines, "gateway_latency_seconds_count", histogram["count"], {"call": name})
+    return "\n".join(lines) + "\n"
+
+def initialize(app):
+    @app.route('/metrics')
+    def metrics():
+        return app.response_class(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,99 @@
+from flask.cli import with_appcontext
+from playhouse.migrate import SchemaMigrator, migrate
+from peewee import fn
+import click
+import os
+import models
+
+AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', 'False') == 'True'
+
+ALL_MODELS = [models.Product, models.ShippingInformation, models.CreditCard, models.Error, models.Transaction, models.Order, models.OrderProduct]
+
+# Every step inspects the schema first, so apply() can run on any database, any number of times
+
+def _has_index(table, columns, unique=False):
+    for index in models.database.get_indexes(table):
+        if index.columns == columns and (index.unique or not unique):
+            return True
+    return False
+
+def rename_product_table(migrator):
+    # Product.Meta used to say tableName, which peewee ignores, so the table was created as "product"
+    tables = models.database.get_tables()
+    if "product" in tables and models.Product._meta.table_name not in tables:
+        migrate(migrator.rename_table("product", models.Product._meta.table_name))
+        return True
+    return False
+
+def create_missing_tables(migrator):
+    missing = [model for model in ALL_MODELS if not model.table_exists()]
+    models.database.create_tables(missing)
+    return bool(missing)
+
+def add_product_content_hash(migrator):
+    table = models.Product._meta.table_name
+    columns = [column.name for column in models.database.get_columns(table)]
+    if "contentHash" in columns:
+        return False
+    migrate(migrator.add_column(table, "contentHash", models.Product.contentHash))
+    return True
+
+def merge_duplicate_order_products(migrator):
+    # The unique index rules duplicates out, and skipping the GROUP BY keeps startup cheap on a large table
+    if _has_index(models.OrderProduct._meta.table_name, ["order_id", "product_id"], unique=True):
+        return False
+    duplicates = list(models.OrderProduct
+        .select(models.OrderProduct.order, models.OrderProduct.product, fn.SUM(models.OrderProduct.quantity))
+        .group_by(models.OrderProduct.order, models.OrderProduct.product)
+        .having(fn.COUNT(models.OrderProduct.id) > 1)
+        .tuples())
+    for order_id, product_id, quantity in duplicates:
+        (models.OrderProduct
+            .delete()
+            .where((models.OrderProduct.order == order_id) & (models.OrderProduct.product == product_id))
+            .execute())
+        models.OrderProduct.create(order=order_id, product=product_id, quantity=quantity)
+    return bool(duplicates)
+
+def add_order_product_index(migrator):
+    # Unique (order, product) also serves every OrderProduct.order == id lookup
+    table = models.OrderProduct._meta.table_name
+    if _has_index(table, ["order_id", "product_id"], unique=True):
+        return False
+    migrate(migrator.add_index(table, ("order_id", "product_id"), True))
+    return True
+
+def add_paid_order_index(migrator):
+    table = models.Order._meta.table_name
+    if _has_index(table, ["paid", "id"]):
+        return False
+    migrate(migrator.add_index(table, ("paid", "id"), False))
+    return True
+
+MIGRATIONS = [
+    rename_product_table,
+    create_missing_tables,
+    add_product_content_hash,
+    merge_duplicate_order_products,
+    add_order_product_index,
+    add_paid_order_index,
+]
+
+def apply():
+    applied = []
+    with models.database.connection_context():
+        migrator = SchemaMigrator.from_database(models.database)
+        for migration in MIGRATIONS:
+            with models.database.atomic():
+                if migration(migrator):
+                    applied.append(migration.__name__)
+    return applied
+
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    applied = apply()
+    if applied:
+        click.echo("Applied: {0}.".format(", ".join(applied)))
+    else:
+        click.echo("Database schema is up to date.")
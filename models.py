@@ -1,14 +1,13 @@
-from flask import g
-from flask import Flask
-from flask import current_app
 from flask.cli import with_appcontext
 import json
-import sqlite3
-import requests
+import instrumentation
 from peewee import *
+from playhouse.pool import PooledPostgresqlDatabase, PooledSqliteDatabase
+from hashlib import sha1
 import click
-import psycopg2
 import os
+import threading
+import time
 
 def get_db():
     return {
@@ -19,7 +18,55 @@ def get_db():
     }
 
 DATABASE_NAME = os.environ.get('DB_NAME', '8inf349')
-database = PostgresqlDatabase(DATABASE_NAME, **get_db())
+DATABASE_ENGINE = os.environ.get('DB_ENGINE', 'postgres')
+MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', '20'))
+STALE_TIMEOUT = int(os.environ.get('DB_STALE_TIMEOUT', '300'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+IMPORT_CHUNK = int(os.environ.get('IMPORT_CHUNK', '1000'))
+
+_pool_stats_lock = threading.Lock()
+pool_stats = {"checkouts": 0, "wait_seconds": 0.0}
+
+# Times every checkout, including the wait when all connections are in use
+class PoolMetricsMixin(object):
+    def connect(self, reuse_if_open=False):
+        start = time.perf_counter()
+        try:
+            return super(PoolMetricsMixin, self).connect(reuse_if_open)
+        finally:
+            waited = time.perf_counter() - start
+            with _pool_stats_lock:
+                pool_stats["checkouts"] += 1
+                pool_stats["wait_seconds"] += waited
+
+class QueryTimingMixin(object):
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super(QueryTimingMixin, self).execute_sql(sql, params, *args, **kwargs)
+        finally:
+            instrumentation.record("db", sql.split(" ", 1)[0].lower(), time.perf_counter() - start)
+
+class PostgresPool(QueryTimingMixin, PoolMetricsMixin, PooledPostgresqlDatabase):
+    pass
+
+class SqlitePool(QueryTimingMixin, PoolMetricsMixin, PooledSqliteDatabase):
+    pass
+
+def create_database():
+    if DATABASE_ENGINE == 'sqlite':
+        # Pooled connections move between threads
+        return SqlitePool("{0}.sqlite".format(DATABASE_NAME), max_connections=MAX_CONNECTIONS, stale_timeout=STALE_TIMEOUT, timeout=POOL_TIMEOUT, check_same_thread=False)
+    return PostgresPool(DATABASE_NAME, max_connections=MAX_CONNECTIONS, stale_timeout=STALE_TIMEOUT, timeout=POOL_TIMEOUT, **get_db())
+
+database = create_database()
+
+def pool_size():
+    return {
+        "in_use": len(database._in_use),
+        "idle": len(database._connections),
+        "max": MAX_CONNECTIONS,
+    }
 
 class BaseModel(Model):
     class Meta:
@@ -36,9 +83,10 @@ class Product(BaseModel):
     price = FloatField()
     rating = IntegerField()
     inStock = BooleanField()
+    contentHash = TextField(null = True)
 
     class Meta:
-        tableName = "products"
+        table_name = "products"
 
 class ShippingInformation(BaseModel):
     id = AutoField()
@@ -90,6 +138,9 @@ class Order(BaseModel):
     
     class Meta:
         table_name = "orders"
+        indexes = (
+            (("paid", "id"), False),
+        )
 
 class OrderProduct(BaseModel):
     order = ForeignKeyField(Order)
@@ -97,44 +148,103 @@ class OrderProduct(BaseModel):
     quantity = IntegerField()
 
     class Meta:
-        table_name = "orderProducts"               
-
-def db_connection():
-    conn = None
-    try:
-        conn = sqlite3.connect("products.sqlite")
-    except sqlite3.Error as e:
-        print(e)
-    return conn
+        table_name = "orderProducts"
+        indexes = (
+            (("order", "product"), True),
+        )
 
-# simple utility function to create tables
+# Creates missing tables and brings older schemas up to date: orders survive a catalog refresh
 def create_tables():
-    with database:
-        database.drop_tables([Product, ShippingInformation, CreditCard, Error, Transaction, Order, OrderProduct])
-        database.create_tables([Product, ShippingInformation, CreditCard, Error, Transaction, Order, OrderProduct])
-        
-        url = 'http://jgnault.ddns.net/shops/products/'
-        json_data = requests.get(url).json()
-        for i in json_data['products']:
-            product = Product.create(
-                id = int(i['id']),
-                name = i['name'].replace("\x00", "\uFFFD"),
-                typeOf = i['type'].replace("\x00", "\uFFFD"),
-                description = i['description'].replace("\x00", "\uFFFD"),
-                image = i['image'].replace("\x00", "\uFFFD"),
-                height = i['height'],
-                weight = i['weight'],
-                price = i['price'],
-                rating = i['rating'],
-                inStock = i['in_stock']
-        )
-        
+    import migrations
+    return migrations.apply()
+
+def product_row(i):
+    return {
+        "id" : int(i['id']),
+        "name" : i['name'].replace("\x00", "\uFFFD"),
+        "typeOf" : i['type'].replace("\x00", "\uFFFD"),
+        "description" : i['description'].replace("\x00", "\uFFFD"),
+        "image" : i['image'].replace("\x00", "\uFFFD"),
+        "height" : i['height'],
+        "weight" : i['weight'],
+        "price" : i['price'],
+        "rating" : i['rating'],
+        "inStock" : i['in_stock']
+    }
+
+def content_hash(row):
+    return sha1(json.dumps(row, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Upserts the products in chunks, skipping rows whose content hash did not change.
+# The feed is the whole catalog: products missing from it are taken out of stock
+def import_products(products):
+    stats = {"received": 0, "written": 0, "unchanged": 0, "retired": 0}
+    start = time.perf_counter()
+    with database.connection_context():
+        known = dict(Product.select(Product.id, Product.contentHash).tuples())
+        seen = set()
+        chunk = []
+        for i in products:
+            row = product_row(i)
+            row["contentHash"] = content_hash(row)
+            stats["received"] += 1
+            seen.add(row["id"])
+            if known.get(row["id"]) == row["contentHash"]:
+                stats["unchanged"] += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= IMPORT_CHUNK:
+                _upsert(chunk)
+                stats["written"] += len(chunk)
+                chunk = []
+        if chunk:
+            _upsert(chunk)
+            stats["written"] += len(chunk)
+        stats["retired"] = _retire([id for id in known if id not in seen])
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+# Order lines still reference them, so they are kept. Clearing the hash rewrites them if they come back
+def _retire(ids):
+    retired = 0
+    with database.atomic():
+        for chunk in chunked(ids, IMPORT_CHUNK):
+            retired += (Product
+                .update(inStock=False, contentHash=None)
+                .where(Product.id.in_(chunk) & (Product.inStock == True))
+                .execute())
+    return retired
+
+def _upsert(rows):
+    with database.atomic():
+        (Product
+            .insert_many(rows)
+            .on_conflict(conflict_target=[Product.id], preserve=[field for field in Product._meta.sorted_fields if field is not Product.id])
+            .execute())
+
+# Connections are opened lazily by the first query and handed back to the pool here
+def close_connection(exception):
+    if not database.is_closed():
+        database.close()
+
 def initialize(app):
     app.cli.add_command(init_db_command)
+    app.teardown_request(close_connection)
     
 @click.command("init-db")
+@click.option("--from-file", type=click.File("rb"), help="Import the catalog from a local JSON file instead of the remote shop.")
 @with_appcontext
-def init_db_command():
-    database = PostgresqlDatabase(DATABASE_NAME, **get_db())
+def init_db_command(from_file):
+    import gateway
     create_tables()
-    click.echo("Initialized the database.")
\ No newline at end of file
+    if from_file is not None:
+        products = gateway.iter_products(from_file)
+    else:
+        products = gateway.stream_products()
+    stats = import_products(products)
+    import catalog
+    catalog.bump_version()
+    click.echo("Initialized the database.")
+    rate = stats["received"] / stats["seconds"] if stats["seconds"] > 0 else 0
+    click.echo("{0} products received, {1} written, {2} unchanged, {3} no longer listed in {4:.2f}s ({5:.0f} rows/sec).".format(
+        stats["received"], stats["written"], stats["unchanged"], stats["retired"], stats["seconds"], rate))
\ No newline at end of file
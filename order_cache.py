@@ -0,0 +1,109 @@
+import os
+import cache
+import serialization
+import conditional
+
+TTL = int(os.environ.get('ORDER_CACHE_TTL', '86400'))
+
+CREATED = "created"
+SHIPPING = "shipping"
+PENDING = "payment-pending"
+PAID = "paid"
+
+stats = {"hits": 0, "misses": 0}
+
+def key(id):
+    return "order:{0}".format(id)
+
+def state_key(id):
+    return "order:{0}:state".format(id)
+
+def etag_key(id):
+    return "order:{0}:etag".format(id)
+
+def encoded_key(id, encoding):
+    return "order:{0}:{1}".format(id, encoding)
+
+def state_for(order):
+    if order["paid"]:
+        return PAID
+    if order["shippingInformation"]:
+        return SHIPPING
+    return CREATED
+
+# Cached bodies are the exact response bytes, so hits are sent without parsing
+def serialize(order):
+    return serialization.dumps({"order" : order})
+
+# One MGET for the body, its state and, for paid orders, the ETag and the compressed variant
+def get(id, encoding=None):
+    return entry(cache.redis_cache.mget(keys(id, encoding)), encoding)
+
+def keys(id, encoding=None):
+    found = [key(id), state_key(id), etag_key(id)]
+    if encoding is not None:
+        found.append(encoded_key(id, encoding))
+    return found
+
+# The cache entry from the values of keys(id, encoding), None on a miss
+def entry(values, encoding=None):
+    if values[0] is None or values[1] is None:
+        stats["misses"] += 1
+        return None
+    stats["hits"] += 1
+    return {
+        "body": values[0],
+        "state": values[1].decode("utf-8"),
+        "etag": values[2].decode("utf-8") if values[2] is not None else None,
+        "encoded": values[3] if encoding is not None else None,
+    }
+
+# One MGET for the bodies and states of many orders; only the hits are returned
+def get_many(ids):
+    keys = []
+    for id in ids:
+        keys.append(key(id))
+        keys.append(state_key(id))
+    values = cache.redis_cache.mget(keys) if keys else []
+    entries = {}
+    for position, id in enumerate(ids):
+        body, state = values[2 * position], values[2 * position + 1]
+        if body is None or state is None:
+            stats["misses"] += 1
+            continue
+        stats["hits"] += 1
+        entries[id] = {"body": body, "state": state.decode("utf-8")}
+    return entries
+
+# Read-through fills pass only_if_missing so they never overwrite a newer write-through
+def put(id, state, order, only_if_missing=False):
+    pipe = cache.redis_cache.pipeline()
+    body = _write(pipe, id, state, order, only_if_missing)
+    pipe.execute()
+    return body
+
+def put_many(orders, only_if_missing=False):
+    pipe = cache.redis_cache.pipeline()
+    for order in orders:
+        _write(pipe, order["id"], state_for(order), order, only_if_missing)
+    pipe.execute()
+
+def _write(pipe, id, state, order, only_if_missing):
+    body = serialize(order)
+    pipe.set(key(id), body, ex=TTL, nx=only_if_missing)
+    pipe.set(state_key(id), state, ex=TTL, nx=only_if_missing)
+    # A paid order never changes again, so its ETag and compressed bytes are computed once
+    if state == PAID:
+        pipe.set(etag_key(id), conditional.etag_for(body), ex=TTL, nx=only_if_missing)
+        for encoding, encoded in conditional.compress(body).items():
+            pipe.set(encoded_key(id, encoding), encoded, ex=TTL, nx=only_if_missing)
+    return body
+
+# Written even when the body is not cached, so a read-through fill (nx) cannot hide the state
+def set_state(id, state):
+    cache.redis_cache.set(state_key(id), state, ex=TTL)
+
+def delete(id):
+    keys = [key(id), state_key(id), etag_key(id)]
+    keys.extend(encoded_key(id, encoding) for encoding in conditional.encodings())
+    cache.redis_cache.delete(*keys)
@@ -0,0 +1,77 @@
+from peewee import JOIN, prefetch, chunked
+from playhouse.shortcuts import model_to_dict
+import models
+
+MAX_BATCH = 1000
+
+# Order with every one-to-one relation joined in, so model_to_dict never lazy-loads
+def select():
+    return (models.Order
+        .select(models.Order, models.ShippingInformation, models.CreditCard, models.Transaction, models.Error)
+        .join(models.ShippingInformation, JOIN.LEFT_OUTER)
+        .switch(models.Order)
+        .join(models.CreditCard, JOIN.LEFT_OUTER)
+        .switch(models.Order)
+        .join(models.Transaction, JOIN.LEFT_OUTER)
+        .join(models.Error, JOIN.LEFT_OUTER))
+
+def get(id):
+    return select().where(models.Order.id == id).get()
+
+def products_of(id):
+    query = (models.OrderProduct
+        .select(models.OrderProduct.product, models.OrderProduct.quantity)
+        .where(models.OrderProduct.order == id)
+        .tuples())
+    return [{ "id":product, "quantity":quantity } for product, quantity in query]
+
+def to_dict(order, products=None):
+    result = model_to_dict(order)
+    if result["transaction"] == None:
+        result["transaction"] = {}
+    else:
+        if result["transaction"]["error"] == None:
+            result["transaction"]["error"] = {}
+    if result["creditCard"] == None:
+        result["creditCard"] = {}
+    if result["shippingInformation"] == None:
+        result["shippingInformation"] = {}
+    if products is None:
+        products = products_of(order.id)
+    result["products"] = products
+    return result
+
+def load(id):
+    return to_dict(get(id))
+
+def load_many(ids):
+    query = select().where(models.Order.id.in_(list(ids))).order_by(models.Order.id)
+    result = []
+    for order in prefetch(query, models.OrderProduct):
+        products = [{ "id":x.product_id, "quantity":x.quantity } for x in order.orderproduct_set]
+        result.append(to_dict(order, products))
+    return result
+
+# Walks the (paid, id) index from the given id onwards
+def ids_page(paid, after=None, limit=MAX_BATCH):
+    query = models.Order.select(models.Order.id).where(models.Order.paid == paid)
+    if after is not None:
+        query = query.where(models.Order.id > after)
+    return [id for (id,) in query.order_by(models.Order.id).limit(limit).tuples()]
+
+# Inserts every order and its products in one transaction; quotes come from pricing.quote_parsed
+def create_many(carts, quotes):
+    rows = [{"totalPrice" : quote["total_cents"] / 100, "shippingPrice" : quote["shipping_cents"] / 100} for quote in quotes]
+    with models.database.atomic():
+        if models.database.returning_clause:
+            ids = []
+            for chunk in chunked(rows, models.IMPORT_CHUNK):
+                # Ids come from a sequence in row order, whatever order RETURNING lists them in
+                ids.extend(sorted(id for (id,) in models.Order.insert_many(chunk).returning(models.Order.id).tuples().execute()))
+        else:
+            ids = [models.Order.insert(row).execute() for row in rows]
+        products = [{"order" : id, "product" : product_id, "quantity" : quantity}
+            for id, quantities in zip(ids, carts) for product_id, quantity in quantities.items()]
+        for chunk in chunked(products, models.IMPORT_CHUNK):
+            models.OrderProduct.insert_many(chunk).execute()
+    return ids
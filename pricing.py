@@ -0,0 +1,168 @@
+import catalog
+
+# NumPy is imported by the first batch large enough to use it
+numpy = None
+_numpy_checked = False
+
+# Batches at least this large are priced with NumPy array operations
+VECTOR_THRESHOLD = 256
+MAX_CARTS = 10000
+# Per product, after repeated lines are merged; orderProducts.quantity is a 32-bit integer column
+MAX_QUANTITY = 1000000
+INT64_MAX = 2 ** 63 - 1
+
+MISSING_PRODUCT = {"product": {"code" : "missing-fields", "name" : "La création d'une commande nécessite un produit"}}
+OUT_OF_INVENTORY = {"product": {"code" : "out-of-inventory", "name" : "Le produit demandé n'est pas en inventaire"}}
+
+class PricingError(Exception):
+    def __init__(self, errors):
+        Exception.__init__(self, errors["product"]["code"])
+        self.errors = errors
+
+def to_cents(price):
+    return int(round(price * 100))
+
+def shipping_cents(weight):
+    if weight < 500:
+        return 500
+    elif weight < 2000:
+        return 1000
+    return 2500
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# Validates one cart and merges repeated products into {id: quantity}
+def parse(products):
+    if not isinstance(products, list):
+        raise PricingError(MISSING_PRODUCT)
+    quantities = {}
+    for i in products:
+        if not isinstance(i, dict):
+            raise PricingError(MISSING_PRODUCT)
+        id_received = i.get("id")
+        quantity_received = i.get("quantity")
+        if id_received is None or quantity_received is None:
+            raise PricingError(MISSING_PRODUCT)
+        # Only JSON integers: 5.7 or "5" are rejected rather than silently converted
+        if not _is_integer(id_received) or not _is_integer(quantity_received) or quantity_received < 1:
+            raise PricingError(MISSING_PRODUCT)
+        quantities[id_received] = quantities.get(id_received, 0) + quantity_received
+        if quantities[id_received] > MAX_QUANTITY:
+            raise PricingError(MISSING_PRODUCT)
+    return quantities
+
+def quote(quantities, index=None):
+    if index is None:
+        index = catalog.get()["index"]
+    total = 0
+    weight = 0
+    for product_id, quantity in quantities.items():
+        product = index.get(product_id)
+        if product is None or not product[2]:
+            raise PricingError(OUT_OF_INVENTORY)
+        total += product[0] * quantity
+        weight += product[1] * quantity
+    return {"total_cents": total, "weight": weight, "shipping_cents": shipping_cents(weight)}
+
+def has_numpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_checked = True
+    return numpy is not None
+
+def _arrays(state):
+    arrays = state.get("arrays")
+    if arrays is None:
+        ids = numpy.array(sorted(state["index"]), dtype=numpy.int64)
+        rows = [state["index"][i] for i in ids.tolist()]
+        arrays = {
+            "ids": ids,
+            "price": numpy.array([row[0] for row in rows], dtype=numpy.int64),
+            "weight": numpy.array([row[1] for row in rows], dtype=numpy.int64),
+            "in_stock": numpy.array([bool(row[2]) for row in rows], dtype=bool),
+        }
+        state["arrays"] = arrays
+    return arrays
+
+def _quote_vectorized(parsed, state):
+    arrays = _arrays(state)
+    carts = []
+    ids = []
+    quantities = []
+    for position, cart in enumerate(parsed):
+        if isinstance(cart, PricingError):
+            continue
+        for product_id, quantity in cart.items():
+            carts.append(position)
+            ids.append(product_id)
+            quantities.append(quantity)
+    # int64 sums wrap silently, so a batch that could overflow is left to the Python path
+    largest = max(int(arrays["price"].max()), int(arrays["weight"].max())) if len(arrays["ids"]) else 0
+    if ids and (min(ids) < -INT64_MAX or max(ids) > INT64_MAX or largest * sum(quantities) > INT64_MAX):
+        return None
+    count = len(parsed)
+    carts = numpy.array(carts, dtype=numpy.int64)
+    ids = numpy.array(ids, dtype=numpy.int64)
+    quantities = numpy.array(quantities, dtype=numpy.int64)
+
+    positions = numpy.searchsorted(arrays["ids"], ids)
+    positions = numpy.minimum(positions, max(len(arrays["ids"]) - 1, 0))
+    if len(arrays["ids"]):
+        valid = (arrays["ids"][positions] == ids) & arrays["in_stock"][positions]
+    else:
+        valid = numpy.zeros(len(ids), dtype=bool)
+    rejected = numpy.zeros(count, dtype=bool)
+    rejected[carts[~valid]] = True
+
+    # Integer accumulation keeps the cent totals exact
+    totals = numpy.zeros(count, dtype=numpy.int64)
+    weights = numpy.zeros(count, dtype=numpy.int64)
+    numpy.add.at(totals, carts[valid], arrays["price"][positions[valid]] * quantities[valid])
+    numpy.add.at(weights, carts[valid], arrays["weight"][positions[valid]] * quantities[valid])
+    shipping = numpy.where(weights < 500, 500, numpy.where(weights < 2000, 1000, 2500))
+
+    results = []
+    for position in range(count):
+        if isinstance(parsed[position], PricingError):
+            results.append(parsed[position])
+        elif rejected[position]:
+            results.append(PricingError(OUT_OF_INVENTORY))
+        else:
+            results.append({"total_cents": int(totals[position]), "weight": int(weights[position]), "shipping_cents": int(shipping[position])})
+    return results
+
+# Each result is the {id: quantity} dict or the PricingError for that cart
+def parse_many(carts):
+    parsed = []
+    for cart in carts:
+        try:
+            parsed.append(parse(cart.get("products") if isinstance(cart, dict) else None))
+        except PricingError as error:
+            parsed.append(error)
+    return parsed
+
+# Prices many carts; each result is a quote dict or the PricingError for that cart
+def quote_many(carts):
+    return quote_parsed(parse_many(carts))
+
+def quote_parsed(parsed):
+    state = catalog.get()
+    if len(parsed) >= VECTOR_THRESHOLD and has_numpy():
+        results = _quote_vectorized(parsed, state)
+        if results is not None:
+            return results
+    results = []
+    for cart in parsed:
+        if isinstance(cart, PricingError):
+            results.append(cart)
+            continue
+        try:
+            results.append(quote(cart, state["index"]))
+        except PricingError as error:
+            results.append(error)
+    return results
@@ -0,0 +1,37 @@
+from flask import current_app
+import json
+
+# orjson is imported by the first dump or load
+orjson = None
+_orjson_checked = False
+
+def has_orjson():
+    global orjson, _orjson_checked
+    if not _orjson_checked:
+        try:
+            import orjson
+        except ImportError:
+            orjson = None
+        _orjson_checked = True
+    return orjson is not None
+
+# Both backends emit compact, key-sorted UTF-8 JSON, but not always the same bytes: orjson writes
+# 1e16 and 1e-7 where json writes 1e+16 and 1e-07, null where json writes NaN, and raises TypeError
+# on integers wider than 64 bits. ETags are hashes of these bytes, so every process of a deployment
+# must load the same backend (orjson is in requirements.txt)
+
+def dumps(obj):
+    if has_orjson():
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def loads(data):
+    if has_orjson():
+        return orjson.loads(data)
+    return json.loads(data)
+
+def raw_response(body, status=200):
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+def json_response(obj, status=200):
+    return raw_response(dumps(obj), status)
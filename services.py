@@ -1,26 +1,22 @@
-from flask import Flask, request, jsonify, make_response
-from flask import redirect
-from flask import session
+from flask import Flask, request, make_response, stream_with_context
 from flask.cli import with_appcontext
-from flask import url_for, abort, render_template, flash
-from playhouse.shortcuts import model_to_dict, dict_to_model
-from functools import wraps
-from hashlib import md5
+from playhouse.shortcuts import model_to_dict
 from peewee import *
-import json
 import click
-import requests
 import models
+import migrations
+import catalog
+import pricing
+import serialization
+import cache
+import conditional
+import order_cache
+import orders
+import gateway
+import idempotency
+import instrumentation
+import metrics
 import os
-import psycopg2
-import redis
-from redis import Redis
-from rq import Queue, Worker
-
-REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
-redis_cache = redis.Redis(REDIS_HOST)
-#redis = Redis.from_url("redis://localhost")
-task_manager = Queue(connection=redis_cache)
 
 def create_app(configuration = None):
     app = Flask(__name__, instance_relative_config=True)
@@ -33,59 +29,237 @@ def create_app(configuration = None):
     except OSError:
         pass
     models.initialize(app)
-    #app.cli.add_command(rq_worker)
+    app.cli.add_command(migrations.migrate_command)
+    if app.config.get("AUTO_MIGRATE", migrations.AUTO_MIGRATE):
+        migrations.apply()
+    instrumentation.initialize(app)
+    metrics.initialize(app)
+    app.cli.add_command(catalog.refresh_catalog_command)
+    app.cli.add_command(rq_worker)
 
     @app.route('/')
     def products():  
-        response = list(models.Product.select().dicts())
-        res = make_response(jsonify({"products" : response}), 200)
-        return res, 200  
+        fields_received = request.args.get("fields")
+        cursor_received = request.args.get("cursor")
+        limit_received = request.args.get("limit")
+        streaming = request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson"
+        if full_catalog_requested():
+            return catalog_response(catalog.get())
+
+        fields = catalog.fields_for(fields_received)
+        if fields is None:
+            return serialization.json_response({"errors" : {"product": {"code" : "invalid-fields", "name" : "Un ou plusieurs champs demandés n'existent pas"}}}, 422)
+        try:
+            cursor = int(cursor_received) if cursor_received is not None else None
+            limit = int(limit_received) if limit_received is not None else None
+        except ValueError:
+            return serialization.json_response({"errors" : {"product": {"code" : "invalid-page", "name" : "Les paramètres cursor et limit doivent être des entiers"}}}, 422)
+        if limit is not None and (limit < 1 or limit > catalog.MAX_PAGE_SIZE):
+            return serialization.json_response({"errors" : {"product": {"code" : "invalid-page", "name" : "Le paramètre limit doit être entre 1 et {0}".format(catalog.MAX_PAGE_SIZE)}}}, 422)
+
+        if streaming:
+            res = app.response_class(stream_with_context(catalog.stream(fields, cursor, limit)), mimetype="application/x-ndjson")
+            return res, 200
+
+        rows, next_cursor = catalog.page(fields, cursor, limit)
+        if limit is None and cursor is None:
+            return serialization.json_response({"products" : rows}, 200)
+        return serialization.json_response({"products" : rows, "next_cursor" : next_cursor}, 200)
 
     @app.route('/order', methods=['POST'])
     def create_order():
         if request.is_json:
             req = request.get_json()
             product_received = req.get("products")
-            totalPrice = 0
-            weight = 0
-            for i in product_received:                
-                if i is None:
-                    return make_response(jsonify({"errors" : {"product": {"code" : "missing-fields", "name" : "La création d'une commande nécessite un produit"}}})), 422
-                id_received = i.get("id")
-                quantity_received = i.get("quantity")
-                if id_received is None or quantity_received is None:
-                    return make_response(jsonify({"errors" : {"product": {"code" : "missing-fields", "name" : "La création d'une commande nécessite un produit"}}})), 422
-                if request.method == 'POST':
-                    try:
-                        product = models.Product.get_by_id(i["id"])
-                    except DoesNotExist:
-                        product = None
-                    if product != None and product.inStock:
-                        totalPrice += product.price * quantity_received
-                        weight += product.weight * quantity_received       
-                    else:
-                        return make_response(jsonify({"errors" : {"product": {"code" : "out-of-inventory", "name" : "Le produit demandé n'est pas en inventaire"}}})), 422
-                else:
-                    return "Bad request method", 400
-                            
-            if weight < 500:
-                shippingPrice = 5
-            elif weight < 2000:
-                shippingPrice = 10
-            elif weight >= 2000:
-                shippingPrice = 25      
+            try:
+                quantities = pricing.parse(product_received)
+                price = pricing.quote(quantities)
+            except pricing.PricingError as error:
+                return serialization.json_response({"errors" : error.errors}, 422)
+            totalPrice = price["total_cents"] / 100
+            shippingPrice = price["shipping_cents"] / 100
                 
-            order = models.Order.create(shippingPrice=shippingPrice, totalPrice=totalPrice)
-            for i in product_received:
-                product = models.Product.get_by_id(i["id"])
-                quantity_received = i.get("quantity")
-                models.OrderProduct.create(order=order, product=product, quantity=quantity_received)
+            with models.database.atomic():
+                order = models.Order.create(shippingPrice=shippingPrice, totalPrice=totalPrice)
+                rows = [{"order" : order.id, "product" : product_id, "quantity" : quantity} for product_id, quantity in quantities.items()]
+                models.OrderProduct.insert_many(rows).execute()
            
-            return make_response(jsonify({"Location" : "order/{0}".format(order.id) })), 302
+            return serialization.json_response({"Location" : "order/{0}".format(order.id) }, 302)
                 
         else:
             return "No JSON received", 400   
 
+    @app.route('/order/quote', methods=['POST'])
+    def quote_orders():
+        if not request.is_json:
+            return "No JSON received", 400
+        carts_received = request.get_json().get("carts")
+        if not isinstance(carts_received, list) or len(carts_received) > pricing.MAX_CARTS:
+            return serialization.json_response({"errors" : {"carts": {"code" : "missing-fields", "name" : "La requête nécessite une liste d'au plus {0} paniers".format(pricing.MAX_CARTS)}}}, 422)
+        quotes = []
+        for result in pricing.quote_many(carts_received):
+            if isinstance(result, pricing.PricingError):
+                quotes.append({"errors" : result.errors})
+            else:
+                quotes.append({"totalPrice" : result["total_cents"] / 100, "shippingPrice" : result["shipping_cents"] / 100})
+        return serialization.json_response({"quotes" : quotes}, 200)
+
+    @app.route('/orders', methods=['GET'])
+    def list_orders():
+        ids_received = request.args.get("ids")
+        paid_received = request.args.get("paid")
+        next_after = None
+        if ids_received is not None:
+            try:
+                ids = list(dict.fromkeys(int(id) for id in ids_received.split(",")))
+            except ValueError:
+                return serialization.json_response({"errors" : {"orders": {"code" : "invalid-fields", "name" : "Le paramètre ids doit être une liste d'entiers séparés par des virgules"}}}, 422)
+            if len(ids) > orders.MAX_BATCH:
+                return serialization.json_response({"errors" : {"orders": {"code" : "invalid-fields", "name" : "Au plus {0} commandes peuvent être demandées".format(orders.MAX_BATCH)}}}, 422)
+        elif paid_received in ("true", "false"):
+            try:
+                after = int(request.args["after"]) if "after" in request.args else None
+                limit = int(request.args.get("limit", orders.MAX_BATCH))
+            except ValueError:
+                return serialization.json_response({"errors" : {"orders": {"code" : "invalid-page", "name" : "Les paramètres after et limit doivent être des entiers"}}}, 422)
+            if limit < 1 or limit > orders.MAX_BATCH:
+                return serialization.json_response({"errors" : {"orders": {"code" : "invalid-page", "name" : "Le paramètre limit doit être entre 1 et {0}".format(orders.MAX_BATCH)}}}, 422)
+            ids = orders.ids_page(paid_received == "true", after, limit)
+            if len(ids) == limit:
+                next_after = ids[-1]
+        else:
+            return serialization.json_response({"errors" : {"orders": {"code" : "missing-fields", "name" : "La requête nécessite le paramètre ids ou paid"}}}, 422)
+
+        # Hits come from one MGET, misses from one prefetch query written back to the cache.
+        # set_state always writes the state, so only orders cached as payment-pending or not
+        # cached at all need their job looked up, all in one pipeline
+        entries = order_cache.get_many(ids)
+        pending_ids = pending_payments([id for id in ids if id not in entries or entries[id]["state"] == order_cache.PENDING])
+        found = {}
+        pending = []
+        missing = []
+        for id in ids:
+            if id in found or id in pending or id in missing:
+                continue
+            entry = entries.get(id)
+            if id in pending_ids:
+                # Same check as GET /order/<id>: an order being paid is never read back into the cache
+                pending.append(id)
+            elif entry is not None and entry["state"] != order_cache.PENDING:
+                found[id] = serialization.loads(entry["body"])["order"]
+            else:
+                if entry is not None:
+                    order_cache.delete(id)
+                missing.append(id)
+        if missing:
+            loaded = orders.load_many(missing)
+            order_cache.put_many(loaded, only_if_missing=True)
+            for order in loaded:
+                found[order["id"]] = order
+        result = {"orders" : [found[id] for id in ids if id in found], "pending" : pending}
+        if paid_received is not None and ids_received is None:
+            result["next_after"] = next_after
+        return serialization.json_response(result, 200)
+
+    @app.route('/orders/batch', methods=['POST'])
+    def create_orders():
+        if not request.is_json:
+            return "No JSON received", 400
+        carts_received = request.get_json().get("orders")
+        if not isinstance(carts_received, list) or not carts_received or len(carts_received) > orders.MAX_BATCH:
+            return serialization.json_response({"errors" : {"orders": {"code" : "missing-fields", "name" : "La requête nécessite une liste d'au plus {0} commandes".format(orders.MAX_BATCH)}}}, 422)
+        carts = pricing.parse_many(carts_received)
+        quotes = pricing.quote_parsed(carts)
+        # All or nothing: one invalid cart rejects the whole batch
+        errors = [dict(quote.errors, index=position) for position, quote in enumerate(quotes) if isinstance(quote, pricing.PricingError)]
+        if errors:
+            return serialization.json_response({"errors" : {"carts": errors}}, 422)
+        ids = orders.create_many(carts, quotes)
+        return serialization.json_response({"orders" : [{"Location" : "order/{0}".format(id)} for id in ids]}, 201)
+
+    def update_order(id):
+        try:
+            if (id is None):
+                order = None 
+            else:
+                entry = order_cache.get(id)
+                if entry is not None and entry["state"] == order_cache.PAID:
+                    return serialization.json_response({"errors" : {"order": {"code" : "already-paid", "name" : "La commande a déjà été payée."}}}, 422)
+                # The cached state can be stale (evicted, or refilled by a concurrent GET), so the job is always checked
+                if payment_pending(id):
+                    return ('', 409)
+                order = orders.get(id)
+        except DoesNotExist:
+            order = None
+            
+        if(order is None):
+            return "Commande non existante", 404
+        
+        orderDict = model_to_dict(order)
+        if orderDict["shippingInformation"] == None and orderDict["email"] == None:
+            req = request.get_json()
+            if req.get("credit_card") is not None:
+                return serialization.json_response({"errors" : {"order": {"code" : "missing-fields", "name" : "Les information du client sont nécessaire avant d'appliquer une carte de crédit"}}}, 422)
+            order_received = req.get("order")
+            if order_received is None:
+                return serialization.json_response({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque1 un ou plusieurs champs qui sont obligatoires"}}}, 422)
+            email_received = order_received.get("email")
+            shipping_information_received = order_received.get("shipping_information")
+            if email_received is None or shipping_information_received is None:
+                return serialization.json_response({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque2 un ou plusieurs champs qui sont obligatoires"}}}, 422)
+            country_received = shipping_information_received.get("country")
+            address_received = shipping_information_received.get("address")
+            postal_code_received = shipping_information_received.get("postal_code")
+            city_received = shipping_information_received.get("city")
+            province_received = shipping_information_received.get("province")
+            if country_received is None or address_received is None or postal_code_received is None or city_received is None or province_received is None:
+                return serialization.json_response({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque3 un ou plusieurs champs qui sont obligatoires"}}}, 422)
+
+            shipping_information = models.ShippingInformation.create(
+                country = country_received.replace("\x00", "\uFFFD"),
+                address = address_received.replace("\x00", "\uFFFD"),
+                postalCode = postal_code_received.replace("\x00", "\uFFFD"),
+                city = city_received.replace("\x00", "\uFFFD"),
+                province = province_received.replace("\x00", "\uFFFD")
+            )
+
+            order.email = email_received
+            order.shippingInformation = shipping_information
+            order.save()
+            
+            order = orders.to_dict(order)
+            body = order_cache.put(id, order_cache.SHIPPING, order)
+            return serialization.raw_response(body, 200)
+    
+        elif orderDict["creditCard"] is None:          
+            req = request.get_json()
+            credit_card_received = req.get("credit_card")
+            if credit_card_received is None:
+                return serialization.json_response({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque4 un ou plusieurs champs qui sont obligatoires"}}}, 422)
+            if orderDict["paid"] == True:
+                return serialization.json_response({"errors" : {"order": {"code" : "already-paid", "name" : "La commande a déjà été payée."}}}, 422)
+            name_received = credit_card_received.get("name")
+            number_received = credit_card_received.get("number")
+            cvv_received = credit_card_received.get("cvv")
+            expiration_year_received = credit_card_received.get("expiration_year")
+            expiration_month_received = credit_card_received.get("expiration_month")
+            if name_received is None or number_received is None or expiration_year_received is None or expiration_month_received is None or cvv_received is None:
+                return serialization.json_response({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque5 un ou plusieurs champs qui sont obligatoires"}}}, 422)                        
+                           
+            credit_card = {
+                "name" : name_received,
+                "number" : number_received,
+                "expiration_year" : expiration_year_received,
+                "cvv" : cvv_received,
+                "expiration_month" : expiration_month_received
+            }
+            order_cache.set_state(id, order_cache.PENDING)
+            cache.task_manager.enqueue(pay_command, id, credit_card, job_id=payment_job_id(id))
+            return ('', 202)
+      
+        if orderDict["paid"] == True:
+                return serialization.json_response({"errors" : {"order": {"code" : "already-paid", "name" : "La commande a déjà été payée."}}}, 422)
+
     @app.route('/order/<int:id>', methods=['GET', 'PUT'])
     def get_order(id):        
         if request.method == 'GET':         
@@ -93,286 +267,147 @@ def create_app(configuration = None):
                 if (id is None):
                     order = None 
                 else:
-                    # job = task_manager.get(id)
-                    # if not job.is_finished:
-                        # return ('', 202)
-                    order = redis_cache.get(id)
-                    if (order is None):
-                        order = models.Order.get_by_id(id)
+                    encoding = conditional.accepted_encoding()
+                    entry = order_cache.get(id, encoding)
+                    if entry is None or entry["state"] == order_cache.PENDING:
+                        if payment_pending(id):
+                            return ('', 202)
+                        if entry is not None:
+                            order_cache.delete(id)
+                            entry = None
+                    if (entry is None):
+                        order = orders.load(id)
                     else:
-                        res = make_response(json.loads(order), 200)
-                        return res, 200
+                        return cached_order_response(entry, encoding)
             except DoesNotExist:
                 order = None
                 
             if(order is None):
                 return "Commande non existante", 404
         
-            order = model_to_dict(order)
-            if order["transaction"] == None:
-                order["transaction"] = {}
-            else:               
-                if order["transaction"]["error"] == None:
-                    order["transaction"]["error"] = {}
-            if order["creditCard"] == None:
-                order["creditCard"] = {}
-            if order["shippingInformation"] == None:
-                order["shippingInformation"] = {}
-            order["products"] = list(map(lambda x: { "id":x["product"], "quantity":x["quantity"] }, list(models.OrderProduct.select().where(models.OrderProduct.order == order["id"]).dicts())))
-            res = make_response(jsonify({"order" : order}), 200)
-            return res, 200
+            body = order_cache.put(id, order_cache.state_for(order), order, only_if_missing=True)
+            return serialization.raw_response(body, 200)
                 
         if request.method == 'PUT':
+            idempotency_key = request.headers.get("Idempotency-Key")
+            if idempotency_key is not None:
+                stored = idempotency.replay(id, idempotency_key)
+                if stored is not None:
+                    return stored
             try:
-                if (id is None):
-                    order = None 
-                else:
-                    # job = task_manager.get(id)
-                    # if not job.is_finished:
-                        # return ('', 409)
-                    order = redis_cache.get(id)
-                    if (order is None):
-                        order = models.Order.get_by_id(id)
-                    else:
-                        return make_response(jsonify({"errors" : {"order": {"code" : "already-paid", "name" : "La commande a déjà été payée."}}})), 422
-            except DoesNotExist:
-                order = None
-                
-            if(order is None):
-                return "Commande non existante", 404
-            
-            orderDict = model_to_dict(order)
-            if orderDict["shippingInformation"] == None and orderDict["email"] == None:
-                req = request.get_json()
-                if req.get("credit_card") is not None:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "missing-fields", "name" : "Les information du client sont nécessaire avant d'appliquer une carte de crédit"}}})), 422
-                order_received = req.get("order")
-                if order_received is None:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque1 un ou plusieurs champs qui sont obligatoires"}}})), 422
-                email_received = order_received.get("email")
-                shipping_information_received = order_received.get("shipping_information")
-                if email_received is None or shipping_information_received is None:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque2 un ou plusieurs champs qui sont obligatoires"}}})), 422
-                country_received = shipping_information_received.get("country")
-                address_received = shipping_information_received.get("address")
-                postal_code_received = shipping_information_received.get("postal_code")
-                city_received = shipping_information_received.get("city")
-                province_received = shipping_information_received.get("province")
-                if country_received is None or address_received is None or postal_code_received is None or city_received is None or province_received is None:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque3 un ou plusieurs champs qui sont obligatoires"}}})), 422
+                with idempotency.order_lock(id):
+                    # A retry that waited on the lock may find its answer already stored
+                    if idempotency_key is not None:
+                        stored = idempotency.replay(id, idempotency_key)
+                        if stored is not None:
+                            return stored
+                    res = make_response(update_order(id))
+                    if idempotency_key is not None:
+                        idempotency.remember(id, idempotency_key, res)
+                    return res
+            except idempotency.LockTimeout:
+                return ('', 409)
 
-                shipping_information = models.ShippingInformation.create(
-                    country = country_received.replace("\x00", "\uFFFD"),
-                    address = address_received.replace("\x00", "\uFFFD"),
-                    postalCode = postal_code_received.replace("\x00", "\uFFFD"),
-                    city = city_received.replace("\x00", "\uFFFD"),
-                    province = province_received.replace("\x00", "\uFFFD")
-                )
+    return app
 
-                order.email = email_received
-                order.shippingInformation = shipping_information
-                order.save()
-                
-                order = model_to_dict(order)
-                if order["transaction"] == None:
-                    order["transaction"] = {}
-                else:
-                    if order["transaction"]["error"] == None:
-                        order["transaction"]["error"] = {}
-                if order["creditCard"] == None:
-                    order["creditCard"] = {}
-                if order["shippingInformation"] == None:
-                    order["shippingInformation"] = {}
-                orderProduct = models.OrderProduct.get_by_id(id)
-                orderProduct = model_to_dict(orderProduct)
-                order["products"] = list(map(lambda x: { "id":x["product"], "quantity":x["quantity"] }, list(models.OrderProduct.select().where(models.OrderProduct.order == order["id"]).dicts())))
-                res = make_response(jsonify({"order" : order}), 200)
-                return res, 200
-        
-            elif orderDict["creditCard"] is None:          
-                req = request.get_json()
-                credit_card_received = req.get("credit_card")
-                if credit_card_received is None:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque4 un ou plusieurs champs qui sont obligatoires"}}})), 422
-                if orderDict["paid"] == True:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "already-paid", "name" : "La commande a déjà été payée."}}})), 422
-                name_received = credit_card_received.get("name")
-                number_received = credit_card_received.get("number")
-                first_digits_received = number_received[:4]
-                last_digits_received = number_received[-4:]
-                cvv_received = credit_card_received.get("cvv")
-                expiration_year_received = credit_card_received.get("expiration_year")
-                expiration_month_received = credit_card_received.get("expiration_month")
-                if name_received is None or number_received is None or expiration_year_received is None or expiration_month_received is None or cvv_received is None:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "missing-fields", "name" : "Il manque5 un ou plusieurs champs qui sont obligatoires"}}})), 422                        
-                               
-                # json_data = task_manager.enqueue(pay_command)
-                
-                json_to_send = {
-                        "credit_card" : {
-                            "name" : name_received,
-                            "number" : number_received,
-                            "expiration_year" : expiration_year_received,
-                            "cvv" : cvv_received,
-                            "expiration_month" : expiration_month_received
-                        },
-                        "amount_charged" : orderDict["totalPrice"] + orderDict["shippingPrice"]
-                    }
-                    
-                url = 'http://jgnault.ddns.net/shops/pay/'
-                json_data = requests.post(url, data=json.dumps(json_to_send)).json()
-                
-                if json_data.get("success") is False:
-                    error = models.Error.create(
-                        code = "card-declined".replace("\x00", "\uFFFD"),
-                        name = json_data.get("message").replace("\x00", "\uFFFD")
-                    )
-                    if (orderDict["transaction"] is not None):
-                        transToDel = models.Transaction.get_by_id(id)
-                        transToDel.delete_instance()
-                    transaction = models.Transaction.create(
-                        id = str(id).replace("\x00", "\uFFFD"),
-                        success = False,
-                        error = error,
-                        amountCharged = orderDict["totalPrice"] + orderDict["shippingPrice"]
-                    )   
-                    order.transaction = transaction
-                    order.save()         
-                    return make_response(jsonify({"errors" : {"credit_card": {"code" : "card-declined", "name" : "La carte de crédit a été déclinée"}}})), 422             
+def payment_job_id(id):
+    return "payment-{0}".format(id)
 
-                credit_card = models.CreditCard.create(
-                    name = name_received.replace("\x00", "\uFFFD"),
-                    firstDigits = first_digits_received.replace("\x00", "\uFFFD"),
-                    lastDigits = last_digits_received.replace("\x00", "\uFFFD"),
-                    expirationYear = expiration_year_received,
-                    expirationMonth = expiration_month_received
-                )
-                                
-                transaction_received = json_data.get("transaction")
-                id_received = transaction_received.get("id")
-                success_received = transaction_received.get("success")
-                amount_charged_received = transaction_received.get("amount_charged")                
-                
-                if (orderDict["transaction"] is not None):
-                    transToDel = models.Transaction.get_by_id(id)
-                    transToDel.delete_instance()
-                transaction = models.Transaction.create(
-                    id = id_received.replace("\x00", "\uFFFD"),
-                    success = success_received,
-                    error = None,
-                    amountCharged = amount_charged_received,
-                )
-                    
-                order.paid = True
-                order.creditCard = credit_card
-                order.transaction = transaction
-                order.save()           
+# Cache-hit responses, also sent by the event-loop views of asgi.py
 
-                order = model_to_dict(order)
-                if order["transaction"] == None:
-                    order["transaction"] = {}
-                else:
-                    if order["transaction"]["error"] == None:
-                        order["transaction"]["error"] = {}
-                if order["creditCard"] == None:
-                    order["creditCard"] = {}
-                if order["shippingInformation"] == None:
-                    order["shippingInformation"] = {}
-                orderProduct = models.OrderProduct.get_by_id(id)
-                orderProduct = model_to_dict(orderProduct)
-                order["products"] = list(map(lambda x: { "id":x["product"], "quantity":x["quantity"] }, list(models.OrderProduct.select().where(models.OrderProduct.order == order["id"]).dicts())))
-                res = make_response(jsonify({"order" : order}), 200)
-                redis_cache.set(id, json.dumps({"order" : order}))
-                return res, 200
-                              
-                # return ('', 202)
-          
-            if orderDict["paid"] == True:
-                    return make_response(jsonify({"errors" : {"order": {"code" : "already-paid", "name" : "La commande a déjà été payée."}}})), 422
+def full_catalog_requested():
+    streaming = request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson"
+    return not any(name in request.args for name in ("fields", "cursor", "limit")) and not streaming
 
-    return app
-   
-# def pay_command():
-    # json_to_send = {
-            # "credit_card" : {
-                # "name" : name_received,
-                # "number" : number_received,
-                # "expiration_year" : expiration_year_received,
-                # "cvv" : cvv_received,
-                # "expiration_month" : expiration_month_received
-            # },
-            # "amount_charged" : orderDict["totalPrice"] + orderDict["shippingPrice"]
-        # }
+def catalog_response(state):
+    return conditional.respond(state["body"], state["etag"], state["variants"], conditional.accepted_encoding())
+
+def cached_order_response(entry, encoding):
+    if entry["etag"] is not None:
+        return conditional.respond(entry["body"], entry["etag"], {encoding: entry["encoded"]}, encoding)
+    return serialization.raw_response(entry["body"], 200)
+
+# One pipelined HGETALL for every job; unlike Queue.fetch_job, a missing job costs no LREM
+def pending_payments(ids):
+    if not ids:
+        return set()
+    queue = cache.task_manager
+    jobs = queue.job_class.fetch_many([payment_job_id(id) for id in ids], connection=queue.connection, serializer=queue.serializer)
+    return {id for id, job in zip(ids, jobs) if job is not None and job.get_status(refresh=False) in ("queued", "started", "deferred", "scheduled")}
+
+def payment_pending(id):
+    return id in pending_payments([id])
+
+# Runs in the rq worker, outside of any request. PUT only enqueues it under the
+# order lock when no payment is pending, so two charges never run for one order
+@models.database.connection_context()
+def pay_command(id, credit_card):
+    order = orders.get(id)
+    if order.paid:
+        return None
+
+    json_to_send = {
+            "credit_card" : credit_card,
+            "amount_charged" : order.totalPrice + order.shippingPrice
+        }
         
-    # url = 'http://jgnault.ddns.net/shops/pay/'
-    # json_data = requests.post(url, data=json.dumps(json_to_send)).json()
+    json_data = gateway.pay(json_to_send)
     
-    # if json_data.get("success") is False:
-        # error = models.Error.create(
-            # code = "card-declined".replace("\x00", "\uFFFD"),
-            # name = json_data.get("message").replace("\x00", "\uFFFD")
-        # )
-        # if (orderDict["transaction"] is not None):
-            # transToDel = models.Transaction.get_by_id(id)
-            # transToDel.delete_instance()
-        # transaction = models.Transaction.create(
-            # id = str(id).replace("\x00", "\uFFFD"),
-            # success = False,
-            # error = error,
-            # amountCharged = orderDict["totalPrice"] + orderDict["shippingPrice"]
-        # )   
-        # order.transaction = transaction
-        # order.save()         
-        # return make_response(jsonify({"errors" : {"credit_card": {"code" : "card-declined", "name" : "La carte de crédit a été déclinée"}}})), 422             
+    if json_data.get("success") is False:
+        error = models.Error.create(
+            code = "card-declined".replace("\x00", "\uFFFD"),
+            name = json_data.get("message").replace("\x00", "\uFFFD")
+        )
+        if (order.transaction_id is not None):
+            transToDel = models.Transaction.get_by_id(id)
+            transToDel.delete_instance()
+        transaction = models.Transaction.create(
+            id = str(id).replace("\x00", "\uFFFD"),
+            success = False,
+            error = error,
+            amountCharged = order.totalPrice + order.shippingPrice
+        )   
+        order.transaction = transaction
+        order.save()         
+        order_cache.delete(id)
+        return json_data
 
-    # credit_card = models.CreditCard.create(
-        # name = name_received.replace("\x00", "\uFFFD"),
-        # firstDigits = first_digits_received.replace("\x00", "\uFFFD"),
-        # lastDigits = last_digits_received.replace("\x00", "\uFFFD"),
-        # expirationYear = expiration_year_received,
-        # expirationMonth = expiration_month_received
-    # )
+    credit_card = models.CreditCard.create(
+        name = credit_card["name"].replace("\x00", "\uFFFD"),
+        firstDigits = credit_card["number"][:4].replace("\x00", "\uFFFD"),
+        lastDigits = credit_card["number"][-4:].replace("\x00", "\uFFFD"),
+        expirationYear = credit_card["expiration_year"],
+        expirationMonth = credit_card["expiration_month"]
+    )
                     
-    # transaction_received = json_data.get("transaction")
-    # id_received = transaction_received.get("id")
-    # success_received = transaction_received.get("success")
-    # amount_charged_received = transaction_received.get("amount_charged")                
+    transaction_received = json_data.get("transaction")
+    id_received = transaction_received.get("id")
+    success_received = transaction_received.get("success")
+    amount_charged_received = transaction_received.get("amount_charged")                
     
-    # if (orderDict["transaction"] is not None):
-        # transToDel = models.Transaction.get_by_id(id)
-        # transToDel.delete_instance()
-    # transaction = models.Transaction.create(
-        # id = id_received.replace("\x00", "\uFFFD"),
-        # success = success_received,
-        # error = None,
-        # amountCharged = amount_charged_received,
-    # )
+    if (order.transaction_id is not None):
+        transToDel = models.Transaction.get_by_id(id)
+        transToDel.delete_instance()
+    transaction = models.Transaction.create(
+        id = id_received.replace("\x00", "\uFFFD"),
+        success = success_received,
+        error = None,
+        amountCharged = amount_charged_received,
+    )
         
-    # order.paid = True
-    # order.creditCard = credit_card
-    # order.transaction = transaction
-    # order.save()           
+    order.paid = True
+    order.creditCard = credit_card
+    order.transaction = transaction
+    order.save()           
 
-    # order = model_to_dict(order)
-    # if order["transaction"] == None:
-        # order["transaction"] = {}
-    # else:
-        # if order["transaction"]["error"] == None:
-            # order["transaction"]["error"] = {}
-    # if order["creditCard"] == None:
-        # order["creditCard"] = {}
-    # if order["shippingInformation"] == None:
-        # order["shippingInformation"] = {}
-    # orderProduct = models.OrderProduct.get_by_id(id)
-    # orderProduct = model_to_dict(orderProduct)
-    # order["products"] = list(map(lambda x: { "id":x["product"], "quantity":x["quantity"] }, list(models.OrderProduct.select().where(models.OrderProduct.order == order["id"]).dicts())))
-    # res = make_response(jsonify({"order" : order}), 200)
-    # redis_cache.set(id, json.dumps({"order" : order}))
+    order = orders.to_dict(order)
+    order_cache.put(id, order_cache.PAID, order)
     
-    # return json_data
+    return json_data
 
-# @click.command("worker")
-# @with_appcontext
-# def rq_worker():
-    # worker = Worker([task_manager], connection=redis_cache)
-    # worker.work()
\ No newline at end of file
+@click.command("rq-worker")
+@with_appcontext
+def rq_worker():
+    from rq import Worker
+    worker = Worker([cache.task_manager], connection=cache.redis_cache)
+    worker.work()
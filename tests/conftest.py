@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+
+# Same setup as loadtest.py: a throwaway SQLite database, fakeredis and the stub pay gateway.
+# The environment must be set before models is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="tests-"), "tests")
+os.environ.pop("AUTO_MIGRATE", None)
+
+import fakeredis
+import pytest
+from rq import Queue
+import cache
+import catalog
+import gateway
+import loadtest
+import migrations
+import models
+import services
+
+PRODUCTS = [{"id": i, "name": "Produit {0}".format(i), "type": "test", "description": "", "image": "",
+    "height": 10, "weight": 100 * i, "price": 10.5 * i, "rating": 3, "in_stock": i != 5} for i in range(1, 6)]
+
+@pytest.fixture
+def redis():
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server)
+    cache.redis_cache = client
+    cache.async_redis = fakeredis.FakeAsyncRedis(server=server)
+    cache.task_manager = Queue(connection=client, is_async=False)
+    catalog._state = {"version": None, "body": None, "index": {}}
+    return client
+
+@pytest.fixture(scope="session")
+def charges():
+    received = []
+    gateway.PAY_URL = loadtest.start_stub_gateway(0.005, received)
+    return received
+
+@pytest.fixture
+def app(redis, charges):
+    with models.database.connection_context():
+        models.database.drop_tables(migrations.ALL_MODELS)
+    migrations.apply()
+    models.import_products(PRODUCTS)
+    del charges[:]
+    return services.create_app({"TESTING": True})
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+# Number of SQL statements sent, reset with queries.clear()
+@pytest.fixture
+def queries(monkeypatch):
+    sent = []
+    original = models.database.execute_sql
+
+    def counting(sql, params=None, *args, **kwargs):
+        sent.append(sql)
+        return original(sql, params, *args, **kwargs)
+
+    monkeypatch.setattr(models.database, "execute_sql", counting)
+    return sent
+
+# Redis round trips: the name of each command sent alone, "PIPELINE" for each pipeline executed
+@pytest.fixture
+def commands(redis, monkeypatch):
+    sent = []
+    original = redis.execute_command
+    original_pipeline = redis.pipeline
+
+    def recording(*args, **options):
+        sent.append(str(args[0]).upper())
+        return original(*args, **options)
+
+    def pipeline(*args, **kwargs):
+        pipe = original_pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def recording_execute(*args, **kwargs):
+            sent.append("PIPELINE")
+            return execute(*args, **kwargs)
+
+        pipe.execute = recording_execute
+        return pipe
+
+    monkeypatch.setattr(redis, "execute_command", recording)
+    monkeypatch.setattr(redis, "pipeline", pipeline)
+    return sent
+
+def create_order(client, products=None):
+    res = client.post('/order', json={"products": products or [{"id": 1, "quantity": 2}]})
+    return int(res.get_json()["Location"].split("/")[1])
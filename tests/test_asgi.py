@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import pytest
+from conftest import create_order
+import asgi
+import conditional
+import loadtest
+
+def call(app, method, path, body=b"", headers=()):
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "http_version": "1.1", "method": method, "scheme": "http", "path": path,
+        "raw_path": path.encode(), "query_string": query.encode(), "root_path": "", "server": ("localhost", 80),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers]}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await app(scope, receive, send)
+        headers = {name.decode(): value.decode() for name, value in messages[0]["headers"] if name != b"server-timing"}
+        return messages[0]["status"], headers, b"".join(message.get("body", b"") for message in messages[1:])
+    return run()
+
+# Status, headers (Server-Timing aside) and body as the WSGI test client returns them
+def expected(client, method, path, headers=()):
+    res = client.open(path, method=method, headers=dict(headers))
+    return res.status_code, {name.lower(): value for name, value in res.headers.items() if name != "Server-Timing"}, res.get_data()
+
+@pytest.fixture
+def paid_order(client):
+    # The card PUT takes the order lock, which fakeredis runs with lupa
+    pytest.importorskip("lupa")
+    path = "/order/{0}".format(create_order(client))
+    client.put(path, json=loadtest.SHIPPING)
+    assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 202
+    return path
+
+def test_pool_runs_requests_concurrently():
+    # Every request waits for the others: served one at a time, the barrier would time out
+    barrier = threading.Barrier(4, timeout=5)
+
+    def wsgi(environ, start_response):
+        barrier.wait()
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [environ["PATH_INFO"].encode()]
+
+    app = asgi.AsgiApp(wsgi, threads=4)
+    async def run():
+        return await asyncio.gather(*[call(app, "POST", "/{0}".format(i)) for i in range(4)])
+    assert [body for status, headers, body in asyncio.run(run())] == ["/{0}".format(i).encode() for i in range(4)]
+
+def test_cache_hits_stay_on_the_event_loop(client, paid_order, monkeypatch):
+    app = asgi.AsgiApp(client.application)
+    client.get("/")
+    client.get(paid_order)
+
+    async def no_thread(environ, send):
+        raise AssertionError("served by the thread pool")
+
+    monkeypatch.setattr(app, "call_wsgi", no_thread)
+    for path in ("/", paid_order):
+        for encoding in ["identity"] + conditional.encodings():
+            headers = [("Accept-Encoding", encoding)]
+            assert asyncio.run(call(app, "GET", path, headers=headers)) == expected(client, "GET", path, headers)
+        etag = client.get(path).headers["ETag"]
+        headers = [("If-None-Match", etag)]
+        assert asyncio.run(call(app, "GET", path, headers=headers)) == expected(client, "GET", path, headers)
+
+def test_same_responses_as_wsgi(client, redis):
+    app = asgi.AsgiApp(client.application)
+    id = create_order(client)
+    order = "/order/{0}".format(id)
+    for path in ("/", "/?limit=2", "/?format=ndjson", order, "/order/999", "/orders?ids={0}".format(id)):
+        redis.flushall()
+        assert asyncio.run(call(app, "GET", path)) == expected(client, "GET", path)
+        # Second read, from the cache
+        assert asyncio.run(call(app, "GET", path)) == expected(client, "GET", path)
+
+    cart = b'{"products": [{"id": 1, "quantity": 2}]}'
+    headers = [("Content-Type", "application/json"), ("Content-Length", str(len(cart)))]
+    status, headers, body = asyncio.run(call(app, "POST", "/order", cart, headers))
+    assert status == 302
+    assert client.get(order).get_json()["order"]["products"] == client.get("/" + client.application.json.loads(body)["Location"]).get_json()["order"]["products"]
@@ -0,0 +1,22 @@
+from conftest import PRODUCTS
+import catalog
+import models
+
+def in_stock():
+    with models.database.connection_context():
+        return dict(models.Product.select(models.Product.id, models.Product.inStock).tuples())
+
+def test_import_takes_dropped_products_out_of_stock(client):
+    stats = models.import_products(PRODUCTS[:3])
+    assert stats["retired"] == 1
+    assert in_stock() == {1: True, 2: True, 3: True, 4: False, 5: False}
+
+    catalog.bump_version()
+    res = client.post('/order', json={"products": [{"id": 4, "quantity": 1}]})
+    assert res.status_code == 422
+    assert res.get_json()["errors"]["product"]["code"] == "out-of-inventory"
+
+    # Listed again, the product is rewritten even though its content did not change
+    stats = models.import_products(PRODUCTS)
+    assert stats["written"] == 1
+    assert in_stock()[4] is True
@@ -0,0 +1,31 @@
+import pytest
+from conftest import create_order
+import conditional
+import loadtest
+
+# Only the catalog and paid orders carry an ETag
+@pytest.fixture(params=["/", "paid order"])
+def path(request, client):
+    if request.param == "paid order":
+        # The card PUT takes the order lock, which fakeredis runs with lupa
+        pytest.importorskip("lupa")
+        path = "/order/{0}".format(create_order(client))
+        client.put(path, json=loadtest.SHIPPING)
+        assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 202
+        return path
+    return request.param
+
+def test_etag_differs_per_content_coding(client, path):
+    plain = client.get(path, headers={"Accept-Encoding": "identity"})
+    gzipped = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in plain.headers
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.get_etag() == (plain.get_etag()[0] + "-gzip", False)
+
+@pytest.mark.parametrize("held", [None] + conditional.encodings())
+def test_any_variant_revalidates(client, path, held):
+    etag = client.get(path, headers={"Accept-Encoding": held or "identity"}).headers["ETag"]
+    for encoding in ["identity"] + conditional.encodings():
+        res = client.get(path, headers={"Accept-Encoding": encoding, "If-None-Match": etag})
+        assert res.status_code == 304
+        assert res.get_data() == b""
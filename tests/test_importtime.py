@@ -0,0 +1,15 @@
+import importtime
+
+LAZY = ["numpy", "orjson", "brotli", "requests", "redis", "rq"]
+
+def test_services_import_within_budget(capsys):
+    assert importtime.main(["--runs", "3", "--forbid", ",".join(LAZY)]) == 0
+    assert "Regression" not in capsys.readouterr().err
+
+def test_lazy_modules_not_imported_at_startup():
+    total, imported, children = importtime.measure("services")
+    assert [name for name in LAZY if name in imported] == []
+
+def test_forbidden_import_fails(capsys):
+    assert importtime.main(["--runs", "1", "--forbid", "flask"]) == 1
+    assert "flask is imported at startup" in capsys.readouterr().err
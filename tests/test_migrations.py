@@ -0,0 +1,73 @@
+import os
+import pytest
+from peewee import chunked
+import migrations
+import models
+
+# EXPLAIN_ROWS=1000000 checks the plans at the size of a production orders table
+ROWS = int(os.environ.get('EXPLAIN_ROWS', '20000'))
+
+@pytest.fixture
+def filled(app):
+    with models.database.connection_context():
+        with models.database.atomic():
+            for chunk in chunked(({"totalPrice": 10.5, "shippingPrice": 5, "paid": i % 10 == 0} for i in range(ROWS)), 1000):
+                models.Order.insert_many(chunk).execute()
+            for chunk in chunked(({"order": i + 1, "product": 1 + i % 5, "quantity": 1} for i in range(ROWS)), 1000):
+                models.OrderProduct.insert_many(chunk).execute()
+        models.database.execute_sql("ANALYZE")
+    return ROWS
+
+def plan(query):
+    sql, params = query.sql()
+    with models.database.connection_context():
+        return " ".join(row[-1] for row in models.database.execute_sql("EXPLAIN QUERY PLAN " + sql, params))
+
+# Index names depend on whether create_tables or a migration built them, so they are matched by column
+def uses_index(result, table, columns):
+    with models.database.connection_context():
+        names = [index.name for index in models.database.get_indexes(table) if index.columns[:len(columns)] == columns]
+    return any("INDEX {0} ".format(name) in result + " " for name in names)
+
+def test_order_products_lookup_uses_index(filled):
+    query = (models.OrderProduct
+        .select(models.OrderProduct.product, models.OrderProduct.quantity)
+        .where(models.OrderProduct.order == filled // 2))
+    assert uses_index(plan(query), "orderProducts", ["order_id"])
+
+def test_paid_orders_page_uses_index(filled):
+    query = (models.Order
+        .select(models.Order.id)
+        .where((models.Order.paid == True) & (models.Order.id > filled // 2))
+        .order_by(models.Order.id)
+        .limit(100))
+    result = plan(query)
+    assert uses_index(result, "orders", ["paid", "id"])
+    assert "TEMP B-TREE" not in result
+
+def test_apply_is_idempotent(app):
+    assert migrations.apply() == []
+
+def test_apply_restores_missing_indexes(app):
+    with models.database.connection_context():
+        for table, columns in (("orders", ["paid", "id"]), ("orderProducts", ["order_id", "product_id"])):
+            for index in models.database.get_indexes(table):
+                if index.columns == columns:
+                    models.database.execute_sql('DROP INDEX "{0}"'.format(index.name))
+    assert migrations.apply() == ["add_order_product_index", "add_paid_order_index"]
+    assert migrations.apply() == []
+
+def test_apply_skips_duplicate_scan_once_unique(app, queries):
+    migrations.apply()
+    assert not [sql for sql in queries if "GROUP BY" in sql]
+
+def test_duplicates_merged_before_unique_index(app):
+    with models.database.connection_context():
+        for index in models.database.get_indexes("orderProducts"):
+            if index.columns == ["order_id", "product_id"]:
+                models.database.execute_sql('DROP INDEX "{0}"'.format(index.name))
+        order = models.Order.create(totalPrice=10.5, shippingPrice=5)
+        models.OrderProduct.insert_many([{"order": order.id, "product": 1, "quantity": 2}, {"order": order.id, "product": 1, "quantity": 3}]).execute()
+    assert migrations.apply() == ["merge_duplicate_order_products", "add_order_product_index"]
+    with models.database.connection_context():
+        assert [(line.product_id, line.quantity) for line in models.OrderProduct.select().where(models.OrderProduct.order == order.id)] == [(1, 5)]
@@ -0,0 +1,17 @@
+import threading
+import models
+
+def test_pool_checkouts_counted_from_every_thread(app):
+    before = models.pool_stats["checkouts"]
+
+    def checkouts():
+        for _ in range(200):
+            with models.database.connection_context():
+                pass
+
+    threads = [threading.Thread(target=checkouts) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert models.pool_stats["checkouts"] - before == 8 * 200
@@ -0,0 +1,85 @@
+import pytest
+from rq import Queue
+from conftest import create_order
+import cache
+import loadtest
+import orders
+import services
+
+def test_bulk_read_lists_orders_being_paid_as_pending(client, redis):
+    # The PUTs take the order lock, which fakeredis runs with lupa
+    pytest.importorskip("lupa")
+    cache.task_manager = Queue(connection=redis)
+    id = create_order(client)
+    path = '/order/{0}'.format(id)
+    client.put(path, json=loadtest.SHIPPING)
+    redis.delete("order:{0}".format(id))
+    assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 202
+
+    res = client.get('/orders?ids={0}'.format(id))
+    assert res.get_json() == {"orders": [], "pending": [id]}
+    assert client.get(path).status_code == 202
+    assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 409
+    assert cache.task_manager.job_ids == [services.payment_job_id(id)]
+
+def test_uncached_get_takes_two_queries(client, redis, queries):
+    id = create_order(client)
+    client.put('/order/{0}'.format(id), json=loadtest.SHIPPING)
+    redis.flushall()
+
+    del queries[:]
+    res = client.get('/order/{0}'.format(id))
+    assert res.status_code == 200
+    # The order with its one-to-one relations, then its products
+    assert len(queries) == 2
+
+    del queries[:]
+    assert client.get('/order/{0}'.format(id)).data == res.data
+    assert len(queries) == 0
+
+def test_load_many_takes_two_queries(client, queries):
+    ids = [create_order(client, [{"id": 1, "quantity": i}, {"id": 2, "quantity": 1}]) for i in range(1, 6)]
+    del queries[:]
+    loaded = orders.load_many(ids)
+    assert [order["id"] for order in loaded] == ids
+    assert loaded[2]["products"] == [{"id": 1, "quantity": 3}, {"id": 2, "quantity": 1}]
+    assert len(queries) == 2
+
+def test_all_hit_bulk_read_is_one_mget(client, queries, commands):
+    ids = [create_order(client) for _ in range(3)]
+    path = '/orders?ids=' + ",".join(str(id) for id in ids)
+    cold = client.get(path)
+    assert [order["id"] for order in cold.get_json()["orders"]] == ids
+
+    del queries[:]
+    del commands[:]
+    warm = client.get(path)
+    assert warm.get_json() == cold.get_json()
+    assert len(queries) == 0
+    assert commands == ["MGET"]
+
+def test_cold_bulk_read_is_one_prefetch(client, queries):
+    ids = [create_order(client) for _ in range(3)]
+    del queries[:]
+    client.get('/orders?ids=' + ",".join(str(id) for id in ids))
+    assert len(queries) == 2
+
+def test_cold_bulk_read_takes_constant_round_trips(client, redis, commands):
+    ids = [create_order(client) for _ in range(20)]
+    redis.flushall()
+    del commands[:]
+    res = client.get('/orders?ids=' + ",".join(str(id) for id in ids))
+    assert [order["id"] for order in res.get_json()["orders"]] == ids
+    # Cache read, job lookups, cache fill
+    assert commands == ["MGET", "PIPELINE", "PIPELINE"]
+
+def test_batch_creates_every_order_or_none(client):
+    carts = [{"products": [{"id": 1, "quantity": 1}]}, {"products": [{"id": 5, "quantity": 1}]}]
+    res = client.post('/orders/batch', json={"orders": carts})
+    assert res.status_code == 422
+    assert [error["index"] for error in res.get_json()["errors"]["carts"]] == [1]
+    assert client.get('/orders?paid=false').get_json()["orders"] == []
+
+    res = client.post('/orders/batch', json={"orders": carts[:1] * 3})
+    assert res.status_code == 201
+    assert len(client.get('/orders?paid=false').get_json()["orders"]) == 3
@@ -0,0 +1,99 @@
+import threading
+import pytest
+from rq import Queue, SimpleWorker
+from conftest import create_order
+import cache
+import loadtest
+import order_cache
+import orders
+import serialization
+import services
+
+# fakeredis runs the Lua scripts behind redis-py locks with lupa
+pytest.importorskip("lupa")
+
+@pytest.fixture
+def queue(redis):
+    cache.task_manager = Queue(connection=redis)
+    return cache.task_manager
+
+def shipped_order(client):
+    id = create_order(client)
+    assert client.put('/order/{0}'.format(id), json=loadtest.SHIPPING).status_code == 200
+    return id
+
+def work(queue):
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+def test_concurrent_puts_charge_once(app, queue, charges):
+    id = shipped_order(app.test_client())
+    path = '/order/{0}'.format(id)
+    statuses = []
+
+    def request(i):
+        client = app.test_client()
+        if i % 4 == 0:
+            # Concurrent reads refill the cache from the database while the PUTs run
+            client.get(path)
+        else:
+            res = client.put(path, json=loadtest.CREDIT_CARD, headers={"Idempotency-Key": "key-{0}".format(i % 3)})
+            statuses.append(res.status_code)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert set(statuses) <= {202, 409}
+    assert queue.job_ids == [services.payment_job_id(id)]
+    work(queue)
+    assert len(charges) == 1
+    assert app.test_client().get(path).get_json()["order"]["paid"] is True
+
+def test_stale_cached_state_does_not_enqueue_twice(client, queue, charges):
+    id = shipped_order(client)
+    path = '/order/{0}'.format(id)
+    order_cache.delete(id)
+    # A GET reads the order before the card PUT and writes it back after it
+    order = orders.load(id)
+    assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 202
+    order_cache.put(id, order_cache.SHIPPING, order, only_if_missing=True)
+
+    assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 409
+    assert client.get(path).status_code == 202
+    assert queue.job_ids == [services.payment_job_id(id)]
+    work(queue)
+    assert len(charges) == 1
+    assert client.get(path).get_json()["order"]["paid"] is True
+
+def test_conflict_is_not_replayed(client, queue):
+    id = shipped_order(client)
+    path = '/order/{0}'.format(id)
+    assert client.put(path, json=loadtest.CREDIT_CARD).status_code == 202
+    res = client.put(path, json=loadtest.CREDIT_CARD, headers={"Idempotency-Key": "retry"})
+    assert res.status_code == 409
+
+    work(queue)
+    res = client.put(path, json=loadtest.CREDIT_CARD, headers={"Idempotency-Key": "retry"})
+    assert res.status_code == 422
+    assert "Idempotent-Replayed" not in res.headers
+
+def test_key_reused_for_another_request_is_rejected(client, queue):
+    id = create_order(client)
+    path = '/order/{0}'.format(id)
+    headers = {"Idempotency-Key": "same"}
+    shipped = client.put(path, json=loadtest.SHIPPING, headers=headers)
+    assert shipped.status_code == 200
+
+    res = client.put(path, json=loadtest.CREDIT_CARD, headers=headers)
+    assert res.status_code == 422
+    assert res.get_json()["errors"]["order"]["code"] == "idempotency-key-reused"
+    assert queue.job_ids == []
+
+    # The same request again, even spaced differently, is still replayed
+    res = client.put(path, data=" " + serialization.dumps(loadtest.SHIPPING).decode(), content_type="application/json", headers=headers)
+    assert res.status_code == 200
+    assert res.headers["Idempotent-Replayed"] == "true"
+    assert res.get_data() == shipped.get_data()
+    assert client.put(path, json=loadtest.CREDIT_CARD, headers={"Idempotency-Key": "card"}).status_code == 202
@@ -0,0 +1,65 @@
+import pytest
+import pricing
+
+@pytest.mark.parametrize("line", [
+    {"id": 1, "quantity": 0},
+    {"id": 1, "quantity": -2},
+    {"id": 1, "quantity": 1.5},
+    {"id": 1, "quantity": True},
+    {"id": 5.7, "quantity": 1},
+    {"id": "1", "quantity": 1},
+    {"id": True, "quantity": 1},
+])
+def test_invalid_lines_are_rejected(client, line):
+    with pytest.raises(pricing.PricingError) as error:
+        pricing.parse([line])
+    assert error.value.errors == pricing.MISSING_PRODUCT
+    res = client.post('/order', json={"products": [line]})
+    assert res.status_code == 422
+    assert res.get_json()["errors"]["product"]["code"] == "missing-fields"
+
+def test_repeated_products_are_merged():
+    assert pricing.parse([{"id": 1, "quantity": 2}, {"id": 2, "quantity": 1}, {"id": 1, "quantity": 3}]) == {1: 5, 2: 1}
+
+def test_catalog_prices_in_cents(client):
+    # 10.5 * 3 is 31.499999999999996 in floating point
+    assert pricing.quote({3: 1})["total_cents"] == pricing.to_cents(10.5 * 3) == 3150
+
+def results(carts):
+    return [quote.errors if isinstance(quote, pricing.PricingError) else quote for quote in pricing.quote_many(carts)]
+
+def one_by_one(carts):
+    found = []
+    for cart in carts:
+        try:
+            found.append(pricing.quote(pricing.parse(cart["products"])))
+        except pricing.PricingError as error:
+            found.append(error.errors)
+    return found
+
+@pytest.mark.parametrize("line", [
+    {"id": 1, "quantity": pricing.MAX_QUANTITY + 1},
+    {"id": 1, "quantity": 2 ** 60},
+    {"id": 1, "quantity": 2 ** 70},
+    {"id": 2 ** 70, "quantity": 1},
+    {"id": 1, "quantity": pricing.MAX_QUANTITY},
+])
+def test_oversized_carts_agree_on_both_paths(client, line):
+    carts = [{"products": [line]}] * pricing.VECTOR_THRESHOLD
+    assert results(carts) == one_by_one(carts)
+    single = client.post('/order', json={"products": [line]})
+    batch = client.post('/orders/batch', json={"orders": carts})
+    assert single.status_code == 302 or single.status_code == batch.status_code == 422
+    if single.status_code == 422:
+        assert batch.get_json()["errors"]["carts"][0]["product"]["code"] == single.get_json()["errors"]["product"]["code"]
+
+def test_repeated_lines_count_toward_the_cap():
+    with pytest.raises(pricing.PricingError):
+        pricing.parse([{"id": 1, "quantity": pricing.MAX_QUANTITY}, {"id": 1, "quantity": 1}])
+
+def test_overflowing_batch_falls_back_to_python(client, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(pricing, "MAX_QUANTITY", 2 ** 62)
+    carts = [{"products": [{"id": 1, "quantity": 2 ** 60}]}] * pricing.VECTOR_THRESHOLD
+    assert results(carts) == one_by_one(carts)
+    assert results(carts)[0]["total_cents"] == 1050 * 2 ** 60